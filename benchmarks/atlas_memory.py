@@ -0,0 +1,61 @@
+"""
+Memory benchmark for the submap atlas.
+A synthetic drive of 5000 keyframes moving 1 unit per keyframe, each with
+1000 features and 50 new points observed by it and the previous keyframe.
+Compares the map keeping everything with an Atlas spilling submaps of 50
+keyframes farther than 100 units to disk.
+
+    python -m benchmarks.atlas_memory
+"""
+
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from boxes.slam_toolbox import Atlas, Frame, Map
+
+N_FRAMES = 5000
+N_FEATURES = 1000
+N_NEW_POINTS = 50
+W, H = 1024, 576
+K = np.array([[500.0, 0, W // 2], [0, 500.0, H // 2], [0, 0, 1]])
+
+
+def synthetic_drive(directory=None, n_frames=N_FRAMES, seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.empty((H, W, 3), np.uint8)
+    mapp = Map()
+    if directory is not None:
+        mapp.atlas = Atlas(directory, submap_size=50, radius=100.0)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(n_frames):
+        key_pts = rng.uniform((0, 0), (W, H), (N_FEATURES, 2))
+        descriptors = rng.integers(0, 256, (N_FEATURES, 32), dtype=np.uint8)
+        pose = np.eye(4)
+        pose[2, 3] = -i
+        frame = Frame(mapp, image, K, pose, features=(key_pts, descriptors))
+        if i:
+            prev = mapp.frames[-2]
+            locs = rng.normal(size=(N_NEW_POINTS, 3)) + (0, 0, i)
+            mapp.add_points(
+                locs,
+                np.full((N_NEW_POINTS, 3), 128),
+                [(prev, np.arange(N_NEW_POINTS) + N_NEW_POINTS), (frame, np.arange(N_NEW_POINTS))],
+            )
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, peak, elapsed, len(mapp.frames)
+
+
+if __name__ == "__main__":
+    print(f"{N_FRAMES} keyframes, {N_FEATURES} features, {N_NEW_POINTS} new points per keyframe")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, directory in (("keep all", None), ("atlas", tmp)):
+            current, peak, elapsed, resident = synthetic_drive(directory)
+            print(
+                f"{name:>9}: {current / 2**20:8.1f} MiB, peak {peak / 2**20:8.1f} MiB, "
+                f"{resident} resident keyframes, {elapsed:6.1f} s"
+            )
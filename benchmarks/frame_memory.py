@@ -0,0 +1,57 @@
+"""
+Memory benchmark for map frames.
+A synthetic run of 10k keyframes, each with 1000 features, 50 new points
+and the KD-tree / normalized keypoints used by the search by projection.
+Compares frames that release rebuildable data outside the active window
+with frames that keep everything.
+
+    python -m benchmarks.frame_memory
+"""
+
+import time
+import tracemalloc
+import numpy as np
+
+from boxes.slam_toolbox import Frame, Map, Point
+
+N_FRAMES = 10000
+N_FEATURES = 1000
+N_NEW_POINTS = 50
+W, H = 1024, 576
+K = np.array([[500.0, 0, W // 2], [0, 500.0, H // 2], [0, 0, 1]])
+
+
+def synthetic_run(active_window, n_frames=N_FRAMES, seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.empty((H, W, 3), np.uint8)
+    mapp = Map()
+    mapp.active_window = active_window
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(n_frames):
+        key_pts = rng.uniform((0, 0), (W, H), (N_FEATURES, 2))
+        descriptors = rng.integers(0, 256, (N_FEATURES, 32), dtype=np.uint8)
+        frame = Frame(mapp, image, K, features=(key_pts, descriptors))
+        frame.kd.query_ball_point(key_pts[:N_NEW_POINTS], 2)
+        frame.kps
+        if i:
+            prev = mapp.frames[-2]
+            for j in range(N_NEW_POINTS):
+                pt = Point(mapp, rng.normal(size=3), (128, 128, 128))
+                pt.add_observation(prev, N_NEW_POINTS + j)
+                pt.add_observation(frame, j)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, peak, elapsed
+
+
+if __name__ == "__main__":
+    print(f"{N_FRAMES} frames, {N_FEATURES} features, {N_NEW_POINTS} new points per frame")
+    for name, window in (("keep all", N_FRAMES + 1), ("active window 20", 20)):
+        current, peak, elapsed = synthetic_run(window)
+        print(
+            f"{name:>18}: {current / 2**20:8.1f} MiB "
+            f"({current / N_FRAMES / 1024:6.1f} KiB/frame), "
+            f"peak {peak / 2**20:8.1f} MiB, {elapsed:6.1f} s"
+        )
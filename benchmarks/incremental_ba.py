@@ -0,0 +1,76 @@
+"""
+Bundle adjustment benchmark, graph rebuilt every call against the
+incremental optimizer kept on the Map.
+A synthetic drive of 300 keyframes moving 0.2 units per keyframe, each
+creating 200 points seen by it and the next 4 keyframes, optimized with a
+local window of 10 keyframes after every keyframe.
+
+    python -m benchmarks.incremental_ba
+"""
+
+import time
+import numpy as np
+
+from boxes.slam_toolbox import Frame, Map
+
+N_FRAMES = 300
+N_NEW_POINTS = 200
+N_VIEWS = 5
+W, H = 1024, 576
+K = np.array([[500.0, 0, W // 2], [0, 500.0, H // 2], [0, 0, 1]])
+
+
+def project(pose, locs):
+    cam = locs @ pose[:3, :3].T + pose[:3, 3]
+    return cam[:, :2] / cam[:, 2:] * K[0, 0] + K[:2, 2]
+
+
+def synthetic_drive(seed=0, **options):
+    rng = np.random.default_rng(seed)
+    image = np.empty((H, W, 3), np.uint8)
+    mapp = Map()
+    pending = []  # (locs, ids, first keyframe) of the points still to observe
+    times = []
+    for i in range(N_FRAMES):
+        pose = np.eye(4)
+        pose[2, 3] = -0.2 * i
+        locs = rng.uniform((-4, -2, 6), (4, 2, 12), (N_NEW_POINTS, 3)) + (0, 0, 0.2 * i)
+        pending.append((locs, None, i))
+        observed = [(l, ids, first) for l, ids, first in pending if i - first < N_VIEWS]
+        key_pts = np.concatenate([project(pose, l) for l, _, _ in observed])
+        key_pts += rng.normal(scale=0.5, size=key_pts.shape)
+        descriptors = rng.integers(0, 256, (len(key_pts), 32), dtype=np.uint8)
+        # noisy pose for the optimizer to correct
+        pose[:3, 3] += rng.normal(scale=0.01, size=3)
+        frame = Frame(mapp, image, K, pose, features=(key_pts, descriptors))
+
+        offset, pending = 0, []
+        for l, ids, first in observed:
+            idxs = np.arange(offset, offset + len(l))
+            offset += len(l)
+            if ids is None:
+                ids = np.array([p.id for p in mapp.add_points(l, np.full((len(l), 3), 128), [])])
+            mapp.add_observations(frame, idxs, ids)
+            pending.append((l, ids, first))
+
+        if i >= 2:
+            start = time.perf_counter()
+            mapp.g2optimize(local_window=10, rounds=5, **options)
+            times.append(time.perf_counter() - start)
+    mapp.merge_local_mapping(wait=True)
+    mapp.close_local_mapping()
+    return np.array(times), len(mapp.points)
+
+
+if __name__ == "__main__":
+    print(f"{N_FRAMES} keyframes, {N_NEW_POINTS} new points per keyframe, {N_VIEWS} views")
+    for name, options in (
+        ("rebuild", {}),
+        ("incremental", {"incremental": True}),
+        ("background", {"background": True}),
+    ):
+        times, n_points = synthetic_drive(**options)
+        print(
+            f"{name:>11}: {1000 * times.mean():7.1f} ms per call, "
+            f"last 50 calls {1000 * times[-50:].mean():7.1f} ms, {n_points} points"
+        )
@@ -0,0 +1,70 @@
+"""
+Save / load benchmark for maps.
+A synthetic map of 1M points observed by 3 of 500 keyframes, each with
+6000 features, saved with Map.save and loaded back with Map.load.
+
+    python -m benchmarks.map_io
+"""
+
+import os
+import tempfile
+import time
+import numpy as np
+
+from boxes.slam_toolbox import Frame, Map
+
+N_FRAMES = 500
+N_FEATURES = 6000
+N_POINTS = 1000000
+N_VIEWS = 3
+W, H = 1024, 576
+K = np.array([[500.0, 0, W // 2], [0, 500.0, H // 2], [0, 0, 1]])
+
+
+def synthetic_map(seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.empty((H, W, 3), np.uint8)
+    mapp = Map()
+    for _ in range(N_FRAMES):
+        key_pts = rng.uniform((0, 0), (W, H), (N_FEATURES, 2))
+        descriptors = rng.integers(0, 256, (N_FEATURES, 32), dtype=np.uint8)
+        Frame(mapp, image, K, features=(key_pts, descriptors))
+
+    # every point is seen by N_VIEWS consecutive frames on free keypoints
+    ids = np.arange(N_POINTS)
+    first = ids * N_FRAMES // N_POINTS
+    observations = []
+    for view in range(N_VIEWS):
+        frames = (first + view) % N_FRAMES
+        idxs = np.zeros(N_POINTS, dtype=np.int64)
+        order = np.argsort(frames, kind="stable")
+        _, starts = np.unique(frames[order], return_index=True)
+        for rows in np.split(order, starts[1:]):
+            idxs[rows] = np.arange(len(rows)) + view * (N_FEATURES // N_VIEWS)
+        observations.append((frames, idxs))
+
+    locs = rng.normal(size=(N_POINTS, 3))
+    colors = rng.integers(0, 256, (N_POINTS, 3))
+    ids = np.array([p.id for p in mapp.add_points(locs, colors, [])])
+    for frames, idxs in observations:
+        order = np.argsort(frames, kind="stable")
+        fids, starts = np.unique(frames[order], return_index=True)
+        for fid, rows in zip(fids.tolist(), np.split(order, starts[1:])):
+            mapp.add_observations(mapp.frames[fid], idxs[rows], ids[rows])
+    return mapp
+
+
+if __name__ == "__main__":
+    mapp = synthetic_map()
+    print(f"{N_FRAMES} keyframes, {N_FEATURES} features, {N_POINTS} points, {N_VIEWS} views")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "map.npz")
+        start = time.perf_counter()
+        mapp.save(path)
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = Map.load(path)
+        elapsed = time.perf_counter() - start
+        print(f"size {os.path.getsize(path) / 2**20:.1f} MiB, save {saved:.2f} s, load {elapsed:.2f} s")
+    assert np.array_equal(loaded.alive_ids(), mapp.alive_ids())
+    assert all(np.array_equal(a.point_ids, b.point_ids) for a, b in zip(mapp.frames, loaded.frames))
@@ -0,0 +1,64 @@
+"""
+Benchmark of the descriptor matcher backends.
+Synthetic ORB-like descriptors: every query is a train descriptor with
+up to MAX_FLIPPED_BITS flipped bits, plus random distractor queries. Recall is the share
+of the brute force ratio-test matches that the backend finds as well.
+Time is split into training the index and matching against it, a
+keyframe index is trained once and queried by many frames.
+
+    python -m benchmarks.matcher_recall
+"""
+
+import time
+import numpy as np
+
+from boxes.slam_toolbox.match_frames import DescriptorMatcher, ratio_test
+
+N_FEATURES = (1000, 3000, 10000)
+MAX_FLIPPED_BITS = 30
+DISTRACTORS = 0.3
+REPEATS = 5
+
+
+class SyntheticFrame:
+    def __init__(self, descriptors):
+        self.descriptors = descriptors
+
+
+def synthetic_frames(n, rng):
+    train = rng.integers(0, 256, (n, 32), dtype=np.uint8)
+    flip_rate = rng.integers(0, MAX_FLIPPED_BITS, n)[:, None] / 256
+    flips = rng.random((n, 256)) < flip_rate
+    query = np.packbits(np.unpackbits(train, axis=1) ^ flips, axis=1)
+    n_random = int(n * DISTRACTORS)
+    query[:n_random] = rng.integers(0, 256, (n_random, 32), dtype=np.uint8)
+    return SyntheticFrame(query), SyntheticFrame(train)
+
+
+def run(backend, f1, f2):
+    matcher = DescriptorMatcher(backend)
+    start = time.perf_counter()
+    matcher.index(f2)
+    train_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        idx1, idx2, _ = ratio_test(*matcher.knn_match(f1, f2))
+    match_time = (time.perf_counter() - start) / REPEATS
+    return idx1, idx2, train_time, match_time
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"{'features':>8} {'backend':>7} {'train ms':>9} {'match ms':>9} {'recall':>7}")
+    for n in N_FEATURES:
+        f1, f2 = synthetic_frames(n, rng)
+        ref = None
+        for backend in ("BF", "LSH"):
+            idx1, idx2, train_time, match_time = run(backend, f1, f2)
+            if ref is None:
+                ref = set(zip(idx1, idx2))
+            recall = len(ref & set(zip(idx1, idx2))) / max(1, len(ref))
+            print(
+                f"{n:>8} {backend:>7} {train_time * 1e3:>9.1f} "
+                f"{match_time * 1e3:>9.1f} {recall:>7.3f}"
+            )
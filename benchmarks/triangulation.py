@@ -0,0 +1,55 @@
+"""
+Benchmark of the triangulation backends.
+Random points seen by two cameras, normalized image coordinates with
+noise. Every backend is timed against the per point reference loop, the
+largest difference after dehomogenization is printed for reference
+(parity is tested in tests/test_triangulation.py).
+
+    python -m benchmarks.triangulation
+"""
+
+import time
+import numpy as np
+
+from boxes.slam_toolbox.match_frames import poseRt
+from boxes.slam_toolbox.triangulation import BACKENDS, triangulate
+
+N_POINTS = (500, 2000, 5000)
+NOISE = 1e-3
+REPEATS = 5
+
+
+def synthetic_views(n, rng):
+    pts = np.c_[rng.uniform(-5, 5, n), rng.uniform(-3, 3, n), rng.uniform(4, 30, n)]
+    yaw = 0.05
+    R = np.array(
+        [[np.cos(yaw), 0, np.sin(yaw)], [0, 1, 0], [-np.sin(yaw), 0, np.cos(yaw)]]
+    )
+    pose1, pose2 = poseRt(R, [-0.5, 0.0, 0.1]), np.eye(4)
+    homogeneous = np.c_[pts, np.ones(n)]
+    views = []
+    for pose in (pose1, pose2):
+        cam = (pose[:3] @ homogeneous.T).T
+        views.append(cam[:, 0:2] / cam[:, 2:] + rng.normal(0, NOISE, (n, 2)))
+    return pose1, pose2, views[0], views[1]
+
+
+def run(backend, pose1, pose2, pts1, pts2):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        pts4d = triangulate(pose1, pose2, pts1, pts2, backend)
+    return pts4d[:, 0:3] / pts4d[:, 3:], (time.perf_counter() - start) / REPEATS
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"{'points':>7} {'backend':>7} {'ms':>8} {'speedup':>8} {'max diff':>9}")
+    for n in N_POINTS:
+        views = synthetic_views(n, rng)
+        ref, ref_time = run("Loop", *views)
+        for backend in BACKENDS:
+            pts, t = run(backend, *views)
+            diff = np.abs(pts - ref).max()
+            print(
+                f"{n:>7} {backend:>7} {t * 1e3:>8.2f} {ref_time / t:>8.1f} {diff:>9.1e}"
+            )
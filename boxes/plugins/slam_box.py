@@ -66,8 +66,23 @@ class DetectorDescriptor(RootNode):
         self.algorithm = self.param["algorithm"]
         self.nfeatures = self.param["nfeatures"]
         self.show_points = self.param["show_points"]
+        self.tiles = self.param["tiles"]
+        self.workers = self.param["workers"]
+        self.frontend = self.param["frontend"]
+        self.min_tracked = self.param["min_tracked"]
+        self.keyframes = self.param["keyframes"]
+        self.kf_tracked_ratio = self.param["kf_tracked_ratio"]
+        self.kf_parallax = self.param["kf_parallax"]
+        self.kf_interval = self.param["kf_interval"]
+        self.atlas_dir = self.param["atlas"]
+        self.submap_size = self.param["submap_size"]
+        self.atlas_radius = self.param["atlas_radius"]
         self.mapp = slam_toolbox.Map()
+        self.mapp.keyframe_policy = self.keyframe_policy()
+        self.mapp.atlas = self.atlas()
         self.mask = None
+        self.prev_image, self.prev_gray = None, None
+        self.track_ref, self.track_pts, self.track_idx = None, None, None
 
     def out_frame(self):
         image = self.get_frame(0)
@@ -87,15 +102,24 @@ class DetectorDescriptor(RootNode):
                 x_offset=400,
             )
         K, W, H = self.buffer.variable["camera_data"]
-        frame = slam_toolbox.Frame(
-            self.mapp,
-            image,
-            K,
-            verts=None,
-            algorithm=self.algorithm,
-            mask=self.mask,
-            nfeatures=self.nfeatures,
-        )
+        frame = self.klt_frame(image, K) if self.frontend == "KLT" else None
+        if frame is None:
+            # with the keyframe policy a detected frame waits for MatchPoints
+            # to decide on insertion, except the first one and lost KLT tracks
+            frame = slam_toolbox.Frame(
+                self.mapp,
+                image,
+                K,
+                verts=None,
+                algorithm=self.algorithm,
+                mask=self.mask,
+                nfeatures=self.nfeatures,
+                tiles=self.tiles,
+                workers=self.workers,
+                keyframe=self.mapp.keyframe_policy is None
+                or self.frontend == "KLT"
+                or not self.mapp.frames,
+            )
         # save the received object in a buffer
         self.buffer.variable["slam_data"] = [frame, self.mapp, K, W, H]
         if self.show_points:
@@ -103,13 +127,104 @@ class DetectorDescriptor(RootNode):
                 cv2.circle(image, np.int32(fpt), 5, cc.green, 1)
 
         attributes = ["Algorithm: " + self.algorithm]
+        if self.frontend == "KLT":
+            state = "tracked" if frame.tracked is not None else "detected"
+            attributes.append(f"KLT: {len(frame.key_pts)} {state}")
         return show_attributes(image, attributes)
 
+    def keyframe_policy(self):
+        if not self.keyframes:
+            return None
+        return slam_toolbox.KeyframePolicy(
+            self.kf_tracked_ratio, self.kf_parallax, self.kf_interval
+        )
+
+    def atlas(self):
+        if not self.atlas_dir:
+            return None
+        return slam_toolbox.Atlas(self.atlas_dir, self.submap_size, self.atlas_radius)
+
+    def klt_frame(self, image, K):
+        """Track keypoints of the last keyframe with optical flow from frame
+        to frame. Features are detected again when the tracks run low;
+        returns None when tracking is lost and a plain detection is needed"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        prev_image, self.prev_image = self.prev_image, image.copy()
+        prev_gray, self.prev_gray = self.prev_gray, gray
+        if prev_gray is None or not self.mapp.frames:
+            return None
+        ref = self.mapp.frames[-1]
+        if ref is not self.track_ref:
+            # a new keyframe (always the previous frame) restarts the tracks
+            if self.mapp.keyframe_policy is not None and ref.tracked is not None:
+                new_pts, new_des = self.detect_around(prev_image, ref.key_pts)
+                if len(new_pts):
+                    ref.add_features(new_pts, new_des)
+            self.track_ref = ref
+            self.track_pts = ref.key_pts
+            self.track_idx = np.arange(len(ref.key_pts))
+        pts, ok = slam_toolbox.trackFeaturesKLT(
+            prev_gray, gray, self.track_pts, self.mask
+        )
+        self.track_pts, self.track_idx = pts, self.track_idx[ok]
+        if len(pts) < 8:
+            return None
+        key_pts, descriptors = pts, ref.descriptors[self.track_idx]
+        redetect = len(pts) < self.min_tracked
+        if redetect:
+            # tracked points come first, so Frame.tracked stays valid
+            new_pts, new_des = self.detect_around(image, key_pts)
+            if len(new_pts):
+                key_pts = np.concatenate([key_pts, new_pts])
+                descriptors = np.concatenate([descriptors, new_des])
+        return slam_toolbox.Frame(
+            self.mapp,
+            image,
+            K,
+            features=(key_pts, descriptors),
+            tracked=self.track_idx,
+            keyframe=self.mapp.keyframe_policy is None or redetect,
+        )
+
+    def detect_around(self, image, key_pts):
+        """Detect new features away from the given keypoints"""
+        n_new = self.nfeatures - len(key_pts)
+        if n_new <= 0:
+            return np.empty((0, 2)), None
+        mask = np.full(image.shape[:2], 255, np.uint8)
+        if self.mask is not None:
+            mask[self.mask == 0] = 0
+        for pt in key_pts:
+            cv2.circle(mask, np.int32(pt), 7, 0, -1)
+        new_pts, new_des = slam_toolbox.detectFeatures(
+            image, mask, n_new, self.algorithm, self.tiles, self.workers
+        )
+        if new_des is None:
+            return np.empty((0, 2)), None
+        return new_pts, new_des
+
     def update(self, param):
         self.disabled = param["disabled"]
         self.algorithm = param["algorithm"]
         self.nfeatures = param["nfeatures"]
         self.show_points = param["show_points"]
+        self.tiles = param["tiles"]
+        self.workers = param["workers"]
+        self.frontend = param["frontend"]
+        self.min_tracked = param["min_tracked"]
+        self.keyframes = param["keyframes"]
+        self.kf_tracked_ratio = param["kf_tracked_ratio"]
+        self.kf_parallax = param["kf_parallax"]
+        self.kf_interval = param["kf_interval"]
+        self.mapp.keyframe_policy = self.keyframe_policy()
+        self.atlas_radius = param["atlas_radius"]
+        if param["atlas"] != self.atlas_dir or param["submap_size"] != self.submap_size:
+            self.atlas_dir, self.submap_size = param["atlas"], param["submap_size"]
+            # spilled submaps live in the current atlas, it can't be replaced
+            if self.mapp.atlas is None or not self.mapp.atlas.centers:
+                self.mapp.atlas = self.atlas()
+        if self.mapp.atlas is not None:
+            self.mapp.atlas.radius = self.atlas_radius
 
 
 class MatchPoints(RootNode):
@@ -125,9 +240,21 @@ class MatchPoints(RootNode):
         self.marker_size = self.param["marker_size"]
         self.show_marker = self.param["show_marker"]
         self.method = self.param["method"]
+        self.guided = self.param["guided"]
+        self.guided_radius = self.param["guided_radius"]
+        self.matcher = slam_toolbox.DescriptorMatcher(self.param["matcher"])
+        self.adaptive = self.param["adaptive"]
+        self.show_stats = self.param["show_stats"]
+        self.tracking = self.param["tracking"]
+        self.budget = slam_toolbox.RansacBudget(self.m_trials, adaptive=self.adaptive)
+        self.vocabulary_file = self.param["vocabulary"]
+        self.vocabulary = self.load_vocabulary(self.vocabulary_file)
+        # constant velocity motion model for guided matching
+        self.last_pose, self.velocity = None, None
         self.m_dict = {
             "USAC_ACCURATE" : cv2.USAC_ACCURATE,
             "USAC_MAGSAC": cv2.USAC_MAGSAC,
+            "USAC_PROSAC": cv2.USAC_PROSAC,
             "RANSAC": cv2.RANSAC,
         }
 
@@ -151,28 +278,104 @@ class MatchPoints(RootNode):
         if frame.id == 0:
             return image
 
-        idx1, idx2, Rt = slam_toolbox.match_frame_USAC(
-            mapp.frames[-1],
-            mapp.frames[-2],
-            self.m_samples,
-            self.r_threshold,
-            self.m_trials,
-            self.m_dict[self.method],
-        )
+        f1, f2 = frame, mapp.reference_frame(frame)
+        dist = None
+        if self.vocabulary is not None and (
+            mapp.keyframe_db is None or mapp.keyframe_db.vocabulary is not self.vocabulary
+        ):
+            # keyframes are indexed for relocalization and loop closure
+            mapp.keyframe_db = slam_toolbox.KeyframeDatabase(self.vocabulary, mapp.frames)
+        if f1.tracked is not None:
+            # KLT front end: the first len(f1.tracked) keypoints are tracks
+            idx1, idx2 = np.arange(len(f1.tracked)), f1.tracked
+        elif self.guided and self.velocity is not None:
+            K = self.buffer.variable["slam_data"][2]
+            pose_pred = self.velocity @ self.last_pose
+            idx1, idx2, dist = slam_toolbox.match_frame_guided(
+                f1, f2, mapp, K, pose_pred, self.guided_radius, self.matcher
+            )
+        else:
+            idx1, idx2, dist = slam_toolbox.match_descriptors(f1, f2, self.matcher)
+
+        Rt = None
+        if self.tracking == "PnP":
+            # track against the map, the essential matrix only (re)initializes
+            K = self.buffer.variable["slam_data"][2]
+            inl1, inl2, Rt = slam_toolbox.estimate_pose_PnP(
+                f1, f2, mapp, K, idx1, idx2, self.r_threshold, self.m_trials
+            )
+        if Rt is None:
+            inl1, inl2, Rt = slam_toolbox.estimate_pose_USAC(
+                f1,
+                f2,
+                idx1,
+                idx2,
+                self.r_threshold,
+                self.m_trials,
+                self.m_dict[self.method],
+                # PROSAC samples the best matches first
+                dist if self.method == "USAC_PROSAC" else None,
+                self.budget,
+            )
+        idx1, idx2 = inl1, inl2
+
+        if Rt is None and self.vocabulary is not None:
+            Rt = self.relocalize(f1, f2, mapp)
+            idx1 = idx2 = np.empty(0, dtype=int)
 
         if Rt is None:
             print("[SLAM] Skipping frame due to insufficient matches.")
+            self.last_pose, self.velocity = None, None
             return
 
+        pose = Rt @ f2.pose
+        if self.last_pose is not None:
+            self.velocity = pose @ np.linalg.inv(self.last_pose)
+        self.last_pose = pose
+
+        # insert the frame into the map if the policy asks for a keyframe
+        if f1.id is None and mapp.keyframe_policy.is_keyframe(f1, f2, idx1, idx2):
+            f1.id = mapp.add_frame(f1)
+
         # Adding new data to the buffer
         self.buffer.variable["slam_data"].extend([idx1, idx2, Rt])
 
         if self.show_marker:
-            for pt1 in mapp.frames[-1].key_pts[idx1]:
+            for pt1 in f1.key_pts[idx1]:
                 cv2.circle(image, np.int32(pt1), self.marker_size, cc.yellow)
 
+        if self.show_stats:
+            attributes = [
+                f"{self.method}: cap {self.budget.last_cap} iters "
+                f"(needed {self.budget.needed}) {1000 * self.budget.time:.1f} ms"
+            ]
+            return show_attributes(image, attributes)
         return image
 
+    def load_vocabulary(self, path):
+        if not path:
+            return None
+        try:
+            return slam_toolbox.Vocabulary.load(path)
+        except (OSError, ValueError) as e:
+            print(f"[SLAM] Vocabulary not loaded: {e}")
+            return None
+
+    def relocalize(self, f1, f2, mapp):
+        """Pose of a lost frame from the keyframe database, relative to f2.
+        The frame becomes a keyframe without matches, it is tied to the map
+        again by the search by projection of Triangulate"""
+        K = self.buffer.variable["slam_data"][2]
+        _, _, pose, kf = slam_toolbox.relocalize(
+            f1, mapp, K, self.matcher, self.r_threshold, self.m_trials
+        )
+        if pose is None:
+            return None
+        print(f"[SLAM] Relocalized against keyframe {kf.id}")
+        if f1.id is None:
+            f1.id = mapp.add_frame(f1)
+        return pose @ f2.pose_inv
+
     def update(self, param):
         self.disabled = param["disabled"]
         self.m_samples = param["m_samples"]
@@ -181,6 +384,18 @@ class MatchPoints(RootNode):
         self.marker_size = param["marker_size"]
         self.show_marker = param["show_marker"]
         self.method = param["method"]
+        self.guided = param["guided"]
+        self.guided_radius = param["guided_radius"]
+        if param["matcher"] != self.matcher.backend:
+            self.matcher = slam_toolbox.DescriptorMatcher(param["matcher"])
+        self.adaptive = param["adaptive"]
+        self.show_stats = param["show_stats"]
+        self.tracking = param["tracking"]
+        self.budget.max_trials = self.m_trials
+        self.budget.adaptive = self.adaptive
+        if param["vocabulary"] != self.vocabulary_file:
+            self.vocabulary_file = param["vocabulary"]
+            self.vocabulary = self.load_vocabulary(self.vocabulary_file)
 
 
 class Triangulate(RootNode):
@@ -192,6 +407,9 @@ class Triangulate(RootNode):
         super().__init__(*args, **kwargs)
         self.orb_distance = self.param["orb_distance"]
         self.show_marker = self.param["show_marker"]
+        self.local_map = self.param["local_map"]
+        self.backend = self.param["backend"]
+        self.fuse_radius = self.param["fuse_radius"]
 
     def out_frame(self):
         # start_time = time.time()
@@ -213,125 +431,98 @@ class Triangulate(RootNode):
 
         frame, mapp, K, W, H, idx1, idx2, Rt = self.buffer.variable["slam_data"]
 
-        f1 = mapp.frames[-1]
-        f2 = mapp.frames[-2]
+        f1 = frame
+        f2 = mapp.reference_frame(frame)
+        if f1.id is None:
+            # not a keyframe: track the pose only, the map stays untouched
+            f1.pose = Rt @ f2.pose
+            if self.show_marker:
+                self.draw_matches(image, f1, f2, idx1, idx2)
+            return image
+
         # add new observations if the point is already observed in the previous frame
         # TODO: consider tradeoff doing this before/after search by projection
-        for i, idx in enumerate(idx2):
-            if f2.pts[idx] is not None and f1.pts[idx1[i]] is None:
-                f2.pts[idx].add_observation(f1, idx1[i])
+        pids = f2.point_ids[idx2]
+        known = (pids >= 0) & (f1.point_ids[idx1] < 0) & ~np.isin(pids, f1.point_ids)
+        mapp.add_observations(f1, idx1[known], pids[known])
 
         # get initial positions from fundamental matrix
         f1.pose = Rt @ f2.pose
 
+        # points of the last keyframes that dropped out of the reference frame
+        if self.local_map > 0:
+            points, descriptors, positions = mapp.local_map(self.local_map, f1)
+            idx, found = slam_toolbox.match_local_map(f1, descriptors, positions, K)
+            mapp.add_observations(f1, idx, [points[j].id for j in found])
+
         # pose optimization
         # pose_opt = mapp.optimize(local_window=1, fix_points=True)
         # sbp_pts_count = 0
 
         # search by projection
-        if mapp.points:
-            # project *all* the map points into the current frame
-            map_points = np.array([p.homogeneous() for p in mapp.points])
-            projs = (K @ f1.pose[:3] @ map_points.T).T
-            projs = projs[:, 0:2] / projs[:, 2:]
-
-            # only the points that fit in the frame
-            good_pts = (
-                (projs[:, 0] > 0)
-                & (projs[:, 0] < W)
-                & (projs[:, 1] > 0)
-                & (projs[:, 1] < H)
-            )
-
-            for i, p in enumerate(mapp.points):
-                if not good_pts[i]:
-                    # point not visible in frame
-                    continue
-                if f1 in p.frames:
-                    # we already matched this map point to this frame
-                    # TODO: understand this better
-                    continue
-                for m_idx in f1.kd.query_ball_point(projs[i], 2):
-                    # if point unmatched
-                    if f1.pts[m_idx] is None:
-                        b_dist = p.orb_distance(f1.descriptors[m_idx])
-                        # if any descriptors within 64
-                        if b_dist < self.orb_distance:
-                            p.add_observation(f1, m_idx)
-                            # sbp_pts_count += 1
-                            break
+        idx, points = slam_toolbox.search_by_projection(f1, mapp, K, W, H, self.orb_distance)
+        mapp.add_observations(f1, idx, [p.id for p in points])
 
         # triangulate the points we don't have matches for
-        good_pts4d = np.array([f1.pts[i] is None for i in idx1])
+        new = (f1.point_ids[idx1] < 0) & (f2.point_ids[idx2] < 0)
+        n1, n2 = idx1[new], idx2[new]
 
         # do triangulation in global frame
-        pts4d = slam_toolbox.triangulate(f1.pose, f2.pose, f1.kps[idx1], f2.kps[idx2])
-        good_pts4d &= np.abs(pts4d[:, 3]) != 0
-        pts4d /= pts4d[:, 3:]  # homogeneous 3-D coords
+        pts4d = slam_toolbox.triangulate(
+            f1.pose, f2.pose, f1.kps[n1], f2.kps[n2], self.backend
+        )
+        good = np.abs(pts4d[:, 3]) != 0
+        n1, n2 = n1[good], n2[good]
+        pts4d = pts4d[good] / pts4d[good, 3:]  # homogeneous 3-D coords
+
+        # check points are in front of both cameras
+        pl1 = pts4d @ f1.pose.T
+        pl2 = pts4d @ f2.pose.T
+        good = (pl1[:, 2] >= 0) & (pl2[:, 2] >= 0)
+
+        # check reprojection error
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pp1 = pl1[:, :3] @ K.T
+            pp2 = pl2[:, :3] @ K.T
+            err1 = np.sum((pp1[:, 0:2] / pp1[:, 2:] - f1.key_pts[n1]) ** 2, axis=1)
+            err2 = np.sum((pp2[:, 0:2] / pp2[:, 2:] - f2.key_pts[n2]) ** 2, axis=1)
+        good &= (err1 <= 2) & (err2 <= 2)
+
+        # color points from frame
+        xy = np.int32(f1.key_pts[n1[good]])
+        colors = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)[xy[:, 1], xy[:, 0]]
 
         # adding new points to the map from pairwise matches
-        # new_pts_count = 0
-        for i, p in enumerate(pts4d):
-            if not good_pts4d[i]:
-                continue
-
-            # check parallax is large enough
-            # TODO: learn what parallax means
-            """
-            r1 = np.dot(f1.pose[:3, :3], add_ones(f1.kps[idx1[i]]))
-            r2 = np.dot(f2.pose[:3, :3], add_ones(f2.kps[idx2[i]]))
-            parallax = r1.dot(r2) / (np.linalg.norm(r1) * np.linalg.norm(r2))
-            if parallax >= 0.9998:
-                continue
-            """
-
-            # check points are in front of both cameras
-            pl1 = f1.pose @ p
-            pl2 = f2.pose @ p
-            if pl1[2] < 0 or pl2[2] < 0:
-                continue
-
-            # reproject
-            pp1 = K @ pl1[:3]
-            pp2 = K @ pl2[:3]
-
-            # check reprojection error
-            pp1 = (pp1[0:2] / pp1[2]) - f1.key_pts[idx1[i]]
-            pp2 = (pp2[0:2] / pp2[2]) - f2.key_pts[idx2[i]]
-            pp1 = np.sum(pp1**2)
-            pp2 = np.sum(pp2**2)
-            if pp1 > 2 or pp2 > 2:
-                continue
-
-            # color points from frame
-            cx = np.int32(f1.key_pts[idx1[i], 0])
-            cy = np.int32(f1.key_pts[idx1[i], 1])
-            color = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)[cy, cx]
-
-            pt = slam_toolbox.Point(mapp, p[0:3], color)
-
-            pt.add_observation(f2, idx2[i])
-            pt.add_observation(f1, idx1[i])
-            # new_pts_count += 1
+        points = mapp.add_points(
+            pts4d[good, 0:3], colors, [(f2, n2[good]), (f1, n1[good])]
+        )
+
+        # merge the new points with duplicates already in the map
+        if self.fuse_radius > 0:
+            mapp.fuse_points(self.fuse_radius, self.orb_distance, [p.id for p in points])
 
         # print("Adding:   %d new points, %d search by projection" % (new_pts_count, sbp_pts_count))
         # print("Map:      %d points, %d frames" % (len(self.mapp.points), len(self.mapp.frames)))
         # print("Time:     %.2f ms" % ((time.time()-start_time)*1000.0))
         # print(np.linalg.inv(f1.pose))
         if self.show_marker:
-            for pt1, pt2 in zip(
-                mapp.frames[-1].key_pts[idx1], mapp.frames[-2].key_pts[idx2]
-            ):
-                # cv2.circle(image, np.int32(pt1), 3, (0, 255, 255))
-                cv2.drawMarker(image, np.int32(pt1), cc.red, 1, 7, 1, 8)
-                cv2.line(image, np.int32(pt1), np.int32(pt2), cc.yellow, 1)
+            self.draw_matches(image, f1, f2, idx1, idx2)
 
         return image
 
+    def draw_matches(self, image, f1, f2, idx1, idx2):
+        for pt1, pt2 in zip(f1.key_pts[idx1], f2.key_pts[idx2]):
+            # cv2.circle(image, np.int32(pt1), 3, (0, 255, 255))
+            cv2.drawMarker(image, np.int32(pt1), cc.red, 1, 7, 1, 8)
+            cv2.line(image, np.int32(pt1), np.int32(pt2), cc.yellow, 1)
+
     def update(self, param):
         self.disabled = param["disabled"]
         self.orb_distance = param["orb_distance"]
         self.show_marker = param["show_marker"]
+        self.local_map = param["local_map"]
+        self.backend = param["backend"]
+        self.fuse_radius = param["fuse_radius"]
 
 
 class Show2DMap(RootNode):
@@ -359,19 +550,13 @@ class Show2DMap(RootNode):
             height, width = image.shape[:-1]
             clean_plate = np.zeros((height, width, 3), np.uint8)
             clean_plate[:] = (10, 10, 10)
-            for idx, point in enumerate(mapp.points):
-                cv2.circle(
-                    clean_plate,
-                    (
-                        np.int32(point.pt[0] + self.offsetx),
-                        np.int32(point.pt[2] + self.offsety),
-                    ),
-                    self.point_size,
-                    (int(point.color[0]), int(point.color[1]), int(point.color[2])),
-                    1,
-                )
-
-            cam_pts = np.linalg.inv(mapp.frames[-1].pose)[:, [-1]][:3].ravel()
+            ids = mapp.alive_ids()
+            centers = np.int32(mapp.positions[ids][:, [0, 2]] + (self.offsetx, self.offsety))
+            for center, color in zip(centers.tolist(), mapp.colors[ids].tolist()):
+                cv2.circle(clean_plate, center, self.point_size, color, 1)
+
+            frame = self.buffer.variable["slam_data"][0]
+            cam_pts = frame.pose_inv[:, [-1]][:3].ravel()
             cv2.circle(
                 clean_plate,
                 (
@@ -8,7 +8,7 @@ import numpy as np
 
 import cv2
 from skimage.measure import LineModelND, ransac  # type: ignore
-from boxes import RootNode, show_attributes, frame_error
+from boxes import RootNode, show_attributes, frame_error, slam_toolbox
 from boxes.slam_toolbox import Kalman3D
 
 
@@ -24,12 +24,21 @@ class GeneralGraphOptimization(RootNode):
         self.turn_on_sliding_window = self.param["sliding_window"]
         self.sliding_window_size = self.param["sliding_window_size"]
         self.rounds = self.param["rounds"]
+        self.covisible = self.param["covisible"]
+        self.loop_closure = self.param["loop_closure"]
+        self.loop_gap = self.param["loop_gap"]
+        self.incremental = self.param["incremental"]
+        self.background = self.param["background"]
         self.culled_pt = 0
+        self.err, self.culling_time = 0.0, 0.0
+        self.loops = 0
+        self.mapp = None
 
     def out_frame(self):
         image = self.get_frame(0)
         if image is None:
             print("GeneralGraphOptimization stop")
+            self.stop()
             return None
         elif self.disabled:
             return image
@@ -42,13 +51,36 @@ class GeneralGraphOptimization(RootNode):
             )
 
         frame, self.mapp = self.buffer.variable["slam_data"][:2]
-        # optimize the map
-        if frame.id >= 2 and frame.id % self.step_frame == 0:
-            err, self.culled_pt = self.mapp.g2optimize(
+        # the background optimization is merged at the first frame boundary after it finished
+        if self.background:
+            ret = self.mapp.merge_local_mapping()
+            if ret is not None:
+                self.err, self.culled_pt, self.culling_time = ret
+        # loops are searched in the keyframe database of MatchPoints
+        if frame.id is not None and self.loop_closure and self.mapp.keyframe_db is not None:
+            K = self.buffer.variable["slam_data"][2]
+            inl1, inl2, pose, loop_frame = slam_toolbox.detect_loop(
+                frame, self.mapp, K, min_gap=self.loop_gap
+            )
+            if loop_frame is not None:
+                err, fused = self.mapp.close_loop(
+                    frame, loop_frame, pose, inl1, inl2, self.rounds, self.solverSE3
+                )
+                self.loops += 1
+                print(
+                    f"[SLAM] Loop {frame.id} -> {loop_frame.id} closed, "
+                    f"error {err:.3f}, {fused} points fused"
+                )
+        # optimize the map, frames that are not keyframes have no id
+        if frame.id is not None and frame.id >= 2 and frame.id % self.step_frame == 0:
+            self.err, self.culled_pt, self.culling_time = self.mapp.g2optimize(
                 rounds=self.rounds,
                 solverSE3=self.solverSE3,
                 slid_win=self.turn_on_sliding_window,
                 win_size=self.sliding_window_size,
+                covisible=self.covisible,
+                incremental=self.incremental,
+                background=self.background,
             )  # verbose=False
             # print("Optimize: %f units of error" % err)
 
@@ -56,7 +88,11 @@ class GeneralGraphOptimization(RootNode):
             image,
             [
                 "solverSE3: " + self.solverSE3,
+                "Loops: {}".format(self.loops),
                 "Culled: {} points".format(self.culled_pt),
+                "Error: {:.3f} culling {:.1f} ms".format(
+                    self.err, 1000 * self.culling_time
+                ),
             ],
             x_offset=200,
         )
@@ -68,6 +104,18 @@ class GeneralGraphOptimization(RootNode):
         self.turn_on_sliding_window = param["sliding_window"]
         self.sliding_window_size = param["sliding_window_size"]
         self.rounds = param["rounds"]
+        self.covisible = param["covisible"]
+        self.loop_closure = param["loop_closure"]
+        self.loop_gap = param["loop_gap"]
+        self.incremental = param["incremental"]
+        self.background = param["background"]
+        if not self.background:
+            self.stop()
+
+    def stop(self):
+        if self.mapp is not None:
+            self.mapp.close_local_mapping()
+        return True
 
 
 class LineModelOptimization(RootNode):
@@ -97,7 +145,8 @@ class LineModelOptimization(RootNode):
                 x_offset=400,
             )
 
-        map_points = self.buffer.variable["slam_data"][1].points
+        mapp = self.buffer.variable["slam_data"][1]
+        map_points = mapp.points
         if map_points:
             points = np.array([(kp.pt[0], kp.pt[1]) for kp in map_points])
             model_robust, inliers = ransac(
@@ -108,10 +157,10 @@ class LineModelOptimization(RootNode):
                 max_trials=self.m_trials,
             )
             outliers = inliers == False
-            for out_lie, ptx in zip(outliers, map_points):
+            for out_lie, ptx in zip(outliers, map_points[:]):
                 if out_lie:
                     if self.delete_points:
-                        map_points.remove(ptx)  # remove outliers points
+                        mapp.remove_point(ptx)  # remove outliers points
                     ptx.color = np.array([255.0, 0.0, 0.0])  # the point red color
 
         return image
@@ -158,7 +207,8 @@ class KalmanFilterOptimization(RootNode):
 
         """The Kalman filter keeps track of the estimated state 
         of the system and the variance or uncertainty of the estimate. """
-        current_pose = self.buffer.variable["slam_data"][0].pose
+        frame = self.buffer.variable["slam_data"][0]
+        current_pose = frame.pose
         x = current_pose.ravel()[3]
         y = current_pose.ravel()[7]
         z = current_pose.ravel()[11]
@@ -170,6 +220,7 @@ class KalmanFilterOptimization(RootNode):
         current_pose.ravel()[3] = pred[0]
         current_pose.ravel()[7] = pred[1]
         current_pose.ravel()[11] = pred[2]
+        frame.pose = current_pose  # drops the cached inverse pose
 
         return image
 
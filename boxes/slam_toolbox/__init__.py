@@ -1,7 +1,26 @@
-from .frame import Frame
+from .frame import Frame, detectFeatures, trackFeaturesKLT
 from .pointmap import Point, Map
-from .match_frames import poseRt, match_frame, match_frame_USAC
+from .match_frames import (
+    poseRt,
+    match_frame,
+    match_frame_USAC,
+    match_descriptors,
+    match_frame_guided,
+    match_local_map,
+    search_by_projection,
+    DescriptorMatcher,
+    estimate_pose_USAC,
+    estimate_pose_PnP,
+    relocalize,
+    detect_loop,
+    RansacBudget,
+)
 from .display_open3d import DisplayOpen3D
 from .kalman import Kalman3D
-from .optimize_g2o import optimize
+from .optimize_g2o import optimize, IncrementalOptimizer
 from .triangulation import triangulate
+from .keyframe import KeyframePolicy
+from .hamming import hamming_matrix, hamming_pairs
+from .vocabulary import Vocabulary, KeyframeDatabase
+from .atlas import Atlas
+from .local_mapping import LocalMapping
@@ -0,0 +1,201 @@
+"""
+Submap atlas.
+Keyframes are grouped into submaps of consecutive ids. Submaps far from
+the camera are spilled to memory mapped .npy files and leave the Map with
+the observation rows of their keyframes, they are paged back in when the
+camera returns or one of their keyframes is needed (relocalization, loop
+closure). Points seen only by a spilled submap become dormant: they keep
+their id and position column but are not alive until paged back in.
+"""
+
+import os
+import shutil
+import numpy as np
+
+from boxes.slam_toolbox.frame import pack_frames, unpack_frames
+from boxes.slam_toolbox.pointmap import _grow
+
+FRAME_ARRAYS = (
+    "frame_ids",
+    "frame_sizes",
+    "poses",
+    "intrinsics",
+    "kp_offsets",
+    "key_pts",
+    "descriptors",
+)
+ARRAYS = FRAME_ARRAYS + ("obs_point", "obs_frame", "obs_idx", "obs_gen")
+
+
+class Atlas:
+    """
+    Submaps of submap_size keyframes stored in directory.
+
+    Args:
+        submap_size: consecutive keyframe ids per submap
+        radius: submaps with no keyframe within radius of the camera are
+            spilled, they are paged back in within radius / 2
+        keep: the last keep submaps always stay in memory
+
+    Map.save writes the spilled submaps from their files, they stay on disk.
+    """
+
+    def __init__(self, directory, submap_size=50, radius=50.0, keep=2):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.submap_size = submap_size
+        self.radius = radius
+        self.keep = keep
+        self.centers = {}  # spilled submap -> camera centers of its keyframes
+        self._stacked = None  # all the centers and their submaps
+        # a removed point id may be reused, its generation tells the spilled
+        # observations of the old point apart
+        self.gen = np.zeros(0, dtype=np.uint32)
+        self.dormant = np.zeros(0, dtype=bool)
+
+    def submap(self, fid):
+        return fid // self.submap_size
+
+    def spilled(self, fid):
+        return self.submap(fid) in self.centers
+
+    def _path(self, k):
+        return os.path.join(self.directory, f"submap_{k:06d}")
+
+    def forget(self, ids):
+        """The points ids were removed from the map"""
+        if len(ids):
+            self.gen = _grow(self.gen, int(np.max(ids)) + 1)
+            self.gen[ids] += 1
+
+    def update(self, mapp):
+        """
+        Spill and page in submaps around the camera of the last keyframe,
+        called by Map.add_frame before a new keyframe is added.
+        """
+        if not mapp.frames:
+            return
+        camera = mapp.frames[-1].pose_inv[:3, 3]
+        if self.centers:
+            if self._stacked is None:
+                labels = [np.full(len(c), k) for k, c in self.centers.items()]
+                self._stacked = np.concatenate(list(self.centers.values())), np.concatenate(labels)
+            centers, labels = self._stacked
+            near = np.linalg.norm(centers - camera, axis=1) < self.radius / 2
+            for k in np.unique(labels[near]).tolist():
+                self.page_in(mapp, k)
+
+        last = self.submap(mapp.max_frame)
+        old = [f for f in mapp.frames if self.submap(f.id) <= last - self.keep]
+        if not old:
+            return
+        labels = np.array([self.submap(f.id) for f in old])
+        far = np.linalg.norm(np.array([f.pose_inv[:3, 3] for f in old]) - camera, axis=1)
+        far = far > self.radius
+        for k in np.unique(labels).tolist():
+            if far[labels == k].all():
+                self.spill(mapp, k, [f for f, label in zip(old, labels) if label == k])
+
+    def spill(self, mapp, k, frames):
+        """Write the submap k (its resident frames) to disk and drop it from the map"""
+        fids = np.array([f.id for f in frames])
+        touched = np.unique(np.concatenate([f.point_ids[f.point_ids >= 0] for f in frames]))
+        rows, owner = mapp.observation_rows_of(touched)
+        inside = np.isin(mapp.obs_frame[rows], fids)
+        self.gen = _grow(self.gen, mapp.n_points)
+        self.dormant = _grow(self.dormant, mapp.n_points)
+
+        path = self._path(k)
+        os.makedirs(path, exist_ok=True)
+        arrays = pack_frames(frames)
+        arrays.update(
+            obs_point=mapp.obs_point[rows[inside]],
+            obs_frame=mapp.obs_frame[rows[inside]],
+            obs_idx=mapp.obs_idx[rows[inside]],
+            obs_gen=self.gen[mapp.obs_point[rows[inside]]],
+        )
+        for name in ARRAYS:
+            np.save(os.path.join(path, name + ".npy"), arrays[name])
+
+        # points seen only by the submap keep their columns, ids are not reused
+        dormant = touched[np.bincount(owner[~inside], minlength=len(touched)) == 0]
+        mapp.remove_observations(rows[inside])
+        mapp.alive[dormant] = False
+        mapp.touch_points(dormant)
+        self.dormant[dormant] = True
+        for i in dormant.tolist():
+            del mapp.points_by_id[i]
+
+        ids = set(fids.tolist())
+        mapp.frames = [f for f in mapp.frames if f.id not in ids]
+        for fid in ids:
+            del mapp.frames_by_id[fid]
+            mapp.covisibility.pop(fid, None)
+        self.centers[k] = np.array([f.pose_inv[:3, 3] for f in frames])
+        self._stacked = None
+        print(f"[Atlas] Spilled submap {k}: {len(frames)} frames, {len(dormant)} dormant points")
+
+    def page_in_between(self, mapp, first_id, last_id):
+        """Page in the spilled submaps with keyframes between first_id and last_id"""
+        first, last = self.submap(first_id), self.submap(last_id)
+        for k in sorted(self.centers):
+            if first <= k <= last:
+                self.page_in(mapp, k)
+
+    def spilled_arrays(self, mapp):
+        """
+        The pack_frames arrays of every spilled submap read from its files,
+        and the (point, frame, keypoint) columns of their observations that
+        page_in would restore, without paging the submaps in.
+        """
+        self.gen = _grow(self.gen, mapp.n_points)
+        self.dormant = _grow(self.dormant, mapp.n_points)
+        packs, obs = [], []
+        for k in sorted(self.centers):
+            path = self._path(k)
+            data = {
+                name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in ARRAYS
+            }
+            pids = np.array(data["obs_point"])
+            keep = (self.gen[pids] == data["obs_gen"]) & (
+                mapp.alive[pids] | self.dormant[pids]
+            )
+            packs.append({name: data[name] for name in FRAME_ARRAYS})
+            obs.append([pids[keep], data["obs_frame"][keep], data["obs_idx"][keep]])
+        return packs, tuple(np.concatenate(column) for column in zip(*obs))
+
+    def page_in(self, mapp, k):
+        """Load the spilled submap k back into the map"""
+        path = self._path(k)
+        data = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in ARRAYS
+        }
+        frames = unpack_frames(mapp, data)
+        mapp.frames = sorted(mapp.frames + frames, key=lambda f: f.id)
+        mapp.frames_by_id.update((f.id, f) for f in frames)
+        recent = {f.id for f in mapp.frames[-mapp.active_window :]}
+        for f in frames:
+            if f.id not in recent:
+                f.release()
+
+        # observations of points that were not removed meanwhile, waking dormant ones
+        pids, fids, idxs = (np.array(data[n]) for n in ("obs_point", "obs_frame", "obs_idx"))
+        self.gen = _grow(self.gen, mapp.n_points)
+        self.dormant = _grow(self.dormant, mapp.n_points)
+        keep = self.gen[pids] == data["obs_gen"]
+        pids, fids, idxs = pids[keep], fids[keep], idxs[keep]
+        wake = np.unique(pids[self.dormant[pids]])
+        self.dormant[wake] = False
+        mapp.alive[wake] = True
+        mapp.touch_points(wake)
+        keep = mapp.alive[pids]
+        pids, fids, idxs = pids[keep], fids[keep], idxs[keep]
+        for fid in np.unique(fids).tolist():
+            sel = fids == fid
+            mapp.add_observations(mapp.frames_by_id[fid], idxs[sel], pids[sel])
+
+        del data
+        del self.centers[k]
+        self._stacked = None
+        shutil.rmtree(path)
+        print(f"[Atlas] Paged in submap {k}: {len(frames)} frames, {len(wake)} points woken")
@@ -149,8 +149,9 @@ class DisplayOpen3D:
             return
 
         # Extract points and colors
-        pts = np.array([p.pt for p in mapp.points]) * self.scale if mapp.points else np.empty((0, 3))
-        cols = np.array([p.color for p in mapp.points]) * self.color_scale if mapp.points else np.empty((0, 3))
+        ids = mapp.alive_ids()
+        pts = mapp.positions[ids] * self.scale
+        cols = mapp.colors[ids] * self.color_scale
         poses = np.array([f.pose for f in mapp.frames]) if mapp.frames else np.empty((0, 4, 4))
 
         # Compute camera positions
@@ -166,7 +167,7 @@ class DisplayOpen3D:
         all_cols = np.vstack([cols, cam_colors]) if pts.size else cam_colors
 
         # Get last pose for robot
-        pose = np.linalg.inv(mapp.frames[-1].pose) if mapp.frames else None
+        pose = mapp.frames[-1].pose_inv if mapp.frames else None
         self.queue.put((all_pts, all_cols, psize, len(mapp.frames), pose))
 
     def __del__(self):
@@ -2,10 +2,14 @@
 frames processing
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
 from scipy.spatial import cKDTree  # type: ignore
 
+TILE_OVERLAP = 32  # covers the ORB patch / edge threshold of 31 px
+TILE_MIN_DISTANCE = 7  # same as minDistance of goodFeaturesToTrack
+
 
 def featureMappingORB(*frame):
     orb = cv2.ORB_create()
@@ -16,6 +20,8 @@ def featureMappingORB(*frame):
         minDistance=7,
         mask=frame[1],
     )
+    if pts is None:
+        return np.empty((0, 2)), None
     key_pts = [cv2.KeyPoint(x=f[0][0], y=f[0][1], size=20) for f in pts]
     key_pts, descriptors = orb.compute(frame[0], key_pts)
     return np.array([(kp.pt[0], kp.pt[1]) for kp in key_pts]), descriptors
@@ -28,6 +34,97 @@ def featureMappingAKAZE(*frame):
     return np.array([(kp.pt[0], kp.pt[1]) for kp in key_pts]), des
 
 
+_pools = {}
+
+
+def thread_pool(workers):
+    """Shared pool per worker count, OpenCV releases the GIL while detecting"""
+    if workers not in _pools:
+        _pools[workers] = ThreadPoolExecutor(max_workers=workers)
+    return _pools[workers]
+
+
+def featureMappingTiled(image, mask, nfeatures, algorithm="ORB", tiles=2, workers=4):
+    """Detect and describe features on a tiles x tiles grid in parallel.
+    Every tile is extended by TILE_OVERLAP pixels so descriptors near the
+    seams have full support, only keypoints inside the tile core are kept,
+    and the remaining duplicates across neighbouring tiles are removed.
+    """
+    h, w = image.shape[:2]
+    xs = np.linspace(0, w, tiles + 1).astype(int)
+    ys = np.linspace(0, h, tiles + 1).astype(int)
+    n_tile = max(1, int(np.ceil(nfeatures / tiles**2)))
+
+    def detect(cell):
+        (x0, x1), (y0, y1) = cell
+        ex0, ey0 = max(0, x0 - TILE_OVERLAP), max(0, y0 - TILE_OVERLAP)
+        ex1, ey1 = min(w, x1 + TILE_OVERLAP), min(h, y1 + TILE_OVERLAP)
+        sub_mask = None if mask is None else mask[ey0:ey1, ex0:ex1]
+        pts, des = FT[algorithm](image[ey0:ey1, ex0:ex1], sub_mask, n_tile)
+        if des is None or not len(pts):
+            return np.empty((0, 2)), None
+        pts = pts + (ex0, ey0)
+        core = (
+            (pts[:, 0] >= x0) & (pts[:, 0] < x1) & (pts[:, 1] >= y0) & (pts[:, 1] < y1)
+        )
+        return pts[core], des[core]
+
+    cells = [(xc, yc) for yc in zip(ys[:-1], ys[1:]) for xc in zip(xs[:-1], xs[1:])]
+    results = [r for r in thread_pool(workers).map(detect, cells) if r[1] is not None]
+    if not results:
+        return np.empty((0, 2)), None
+
+    key_pts = np.concatenate([r[0] for r in results])
+    descriptors = np.concatenate([r[1] for r in results])
+    labels = np.concatenate([np.full(len(r[0]), i) for i, r in enumerate(results)])
+
+    # border deduplication: close pairs can only come from different tiles
+    pairs = cKDTree(key_pts).query_pairs(TILE_MIN_DISTANCE, output_type="ndarray")
+    pairs = pairs[labels[pairs[:, 0]] != labels[pairs[:, 1]]]
+    keep = np.ones(len(key_pts), dtype=bool)
+    keep[pairs[:, 1]] = False
+    return key_pts[keep], descriptors[keep]
+
+
+def detectFeatures(image, mask=None, nfeatures=1000, algorithm="ORB", tiles=1, workers=1):
+    """Detect and describe features on the whole frame or tile by tile"""
+    if tiles > 1:
+        return featureMappingTiled(image, mask, nfeatures, algorithm, tiles, workers)
+    return FT[algorithm](image, mask, nfeatures)
+
+
+def trackFeaturesKLT(prev_gray, gray, prev_pts, mask=None, fb_threshold=1.0):
+    """Track keypoints of the previous frame with pyramidal Lucas-Kanade.
+    A forward-backward check rejects unreliable tracks.
+    Returns the tracked positions and their indices in the previous frame.
+    """
+    if not len(prev_pts):
+        return np.empty((0, 2)), np.empty(0, dtype=int)
+    lk_params = dict(
+        winSize=(21, 21),
+        maxLevel=3,
+        criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01),
+    )
+    p0 = prev_pts.reshape(-1, 1, 2).astype(np.float32)
+    p1, st1, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, p0, None, **lk_params)
+    p0r, st0, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, p1, None, **lk_params)
+    p1 = p1.reshape(-1, 2)
+    h, w = gray.shape[:2]
+    good = (
+        (st1.ravel() == 1)
+        & (st0.ravel() == 1)
+        & (np.linalg.norm(p0r.reshape(-1, 2) - prev_pts, axis=1) < fb_threshold)
+        & (p1[:, 0] >= 0)
+        & (p1[:, 0] < w)
+        & (p1[:, 1] >= 0)
+        & (p1[:, 1] < h)
+    )
+    if mask is not None:
+        xy = np.int32(p1[good])
+        good[good] = mask[xy[:, 1], xy[:, 0]] > 0
+    return p1[good], np.flatnonzero(good)
+
+
 def normalize(count_inv, pts):
     return (count_inv @ np.concatenate([pts, np.ones((pts.shape[0], 1))], axis=1).T).T[
         :, 0:2
@@ -42,10 +139,40 @@ def denormalize(count_inv, pt):
 
 FT = {"ORB": featureMappingORB, "AKAZE": featureMappingAKAZE}
 
+_intrinsics = {}
+
+
+def intrinsics(K):
+    """Shared read-only copies of K and its inverse for all frames"""
+    K = np.asarray(K, dtype=np.float64)
+    key = K.tobytes()
+    if key not in _intrinsics:
+        K, Kinv = K.copy(), np.linalg.inv(K)
+        K.flags.writeable = Kinv.flags.writeable = False
+        _intrinsics[key] = K, Kinv
+    return _intrinsics[key]
+
 
 class Frame:
     """Contains poses data"""
 
+    __slots__ = (
+        "K",
+        "_Kinv",
+        "_pose",
+        "_pose_inv",
+        "h",
+        "w",
+        "tracked",
+        "key_pts",
+        "descriptors",
+        "point_ids",
+        "id",
+        "active",
+        "_kps",
+        "_kd",
+    )
+
     def __init__(
         self,
         mapp,
@@ -57,31 +184,137 @@ class Frame:
         algorithm="ORB",
         mask=None,
         nfeatures=1000,
+        tiles=1,
+        workers=1,
+        features=None,
+        tracked=None,
+        keyframe=True,
     ):
-        self.K = np.array(K)
-        self.pose = np.array(pose)
+        self.K, self._Kinv = intrinsics(K)
+        self.pose = pose
         self.h, self.w = image.shape[0:2]
-        self.key_pts, self.descriptors = FT[algorithm](image, mask, nfeatures)
-        self.pts = [None] * len(self.key_pts)
-        self.id = tid if tid is not None else mapp.add_frame(self)
+        # KLT tracks: key_pts[i] continues keypoint tracked[i] of the last keyframe
+        self.tracked = tracked
+        if features is None:
+            features = detectFeatures(image, mask, nfeatures, algorithm, tiles, workers)
+        self.key_pts = np.ascontiguousarray(features[0], dtype=np.float32).reshape(-1, 2)
+        self.descriptors = features[1]
+        # ids of the map points observed by the keypoints, -1 for none
+        self.point_ids = np.full(len(self.key_pts), -1, dtype=np.int32)
+        # rebuildable data is only cached while the frame is in the active window
+        self.active = True
+        self._kps, self._kd = None, None
+        # frames that are not keyframes stay out of the map (id is None)
+        # until mapp.add_frame() is called for them
+        self.id = tid if tid is not None else (mapp.add_frame(self) if keyframe else None)
+
+    def add_features(self, key_pts, descriptors):
+        """Append newly detected features, existing indices stay valid"""
+        self.key_pts = np.concatenate([self.key_pts, np.float32(key_pts)])
+        self.descriptors = np.concatenate([self.descriptors, descriptors])
+        self.point_ids = np.concatenate(
+            [self.point_ids, np.full(len(key_pts), -1, dtype=np.int32)]
+        )
+        self._kps, self._kd = None, None
+
+    def release(self):
+        """The frame left the active window, drop data that can be rebuilt"""
+        self.active = False
+        self._kps, self._kd = None, None
+
+    # world to camera transform
+    @property
+    def pose(self):
+        return self._pose
+
+    @pose.setter
+    def pose(self, pose):
+        self._pose = np.array(pose, dtype=np.float64)
+        self._pose_inv = None
+
+    # camera to world transform
+    @property
+    def pose_inv(self):
+        if self._pose_inv is None:
+            self._pose_inv = np.linalg.inv(self._pose)
+        return self._pose_inv
 
     # inverse of intrinsics matrix
     @property
     def Kinv(self):
-        if not hasattr(self, "_Kinv"):
-            self._Kinv = np.linalg.inv(self.K)
         return self._Kinv
 
     # normalized keypoints
     @property
     def kps(self):
-        if not hasattr(self, "_kps"):
-            self._kps = normalize(self.Kinv, self.key_pts)
-        return self._kps
+        if self._kps is not None:
+            return self._kps
+        kps = normalize(self.Kinv, self.key_pts)
+        if self.active:
+            self._kps = kps
+        return kps
 
     # KD tree of unnormalized keypoints
     @property
     def kd(self):
-        if not hasattr(self, "_kd"):
-            self._kd = cKDTree(self.key_pts)
-        return self._kd
+        if self._kd is not None:
+            return self._kd
+        kd = cKDTree(self.key_pts)
+        if self.active:
+            self._kd = kd
+        return kd
+
+
+def pack_frames(frames):
+    """
+    Frames as plain arrays: ids, image sizes, poses, intrinsics, and the
+    keypoints and descriptors of all frames concatenated with offsets.
+    """
+    des = [f.descriptors for f in frames if f.descriptors is not None]
+    empty = np.empty((0,) + des[0].shape[1:], des[0].dtype) if des else np.empty((0, 32), np.uint8)
+    n_kps = np.array([len(f.key_pts) for f in frames], dtype=np.int64)
+    return dict(
+        frame_ids=np.array([f.id for f in frames], dtype=np.int64),
+        frame_sizes=np.array([(f.h, f.w) for f in frames], dtype=np.int64).reshape(-1, 2),
+        poses=np.array([f.pose for f in frames]).reshape(-1, 4, 4),
+        intrinsics=np.array([f.K for f in frames]).reshape(-1, 3, 3),
+        kp_offsets=np.concatenate([[0], np.cumsum(n_kps)]),
+        key_pts=np.concatenate([f.key_pts for f in frames] + [np.empty((0, 2), np.float32)]),
+        descriptors=np.concatenate(
+            [f.descriptors if f.descriptors is not None else empty for f in frames] + [empty]
+        ),
+    )
+
+
+def concat_packed(packs):
+    """pack_frames arrays of several groups of frames as one, in frame id order"""
+    order = np.argsort(np.concatenate([p["frame_ids"] for p in packs]), kind="stable")
+    n_kps = np.concatenate([np.diff(p["kp_offsets"]) for p in packs])[order]
+    bases = np.cumsum([0] + [p["kp_offsets"][-1] for p in packs[:-1]])
+    starts = np.concatenate([p["kp_offsets"][:-1] + b for p, b in zip(packs, bases)])[order]
+    rows = np.repeat(starts - (np.cumsum(n_kps) - n_kps), n_kps) + np.arange(n_kps.sum())
+    ret = {
+        name: np.concatenate([p[name] for p in packs])[order]
+        for name in ("frame_ids", "frame_sizes", "poses", "intrinsics")
+    }
+    ret["kp_offsets"] = np.concatenate([[0], np.cumsum(n_kps)])
+    for name in ("key_pts", "descriptors"):
+        ret[name] = np.concatenate([p[name] for p in packs])[rows]
+    return ret
+
+
+def unpack_frames(mapp, arrays):
+    """Frames of pack_frames arrays, not added to the map"""
+    offsets, key_pts, descriptors = arrays["kp_offsets"], arrays["key_pts"], arrays["descriptors"]
+    sizes, intrinsics, poses = arrays["frame_sizes"], arrays["intrinsics"], arrays["poses"]
+    ret = []
+    for i, fid in enumerate(np.asarray(arrays["frame_ids"]).tolist()):
+        h, w = sizes[i]
+        features = (
+            np.array(key_pts[offsets[i] : offsets[i + 1]]),
+            np.array(descriptors[offsets[i] : offsets[i + 1]]),
+        )
+        # the image is only needed for its size
+        image = np.broadcast_to(np.uint8(0), (h, w, 3))
+        ret.append(Frame(mapp, image, intrinsics[i], poses[i], fid, features=features))
+    return ret
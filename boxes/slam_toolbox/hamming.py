@@ -0,0 +1,37 @@
+"""
+Hamming distance of binary descriptors (ORB, AKAZE), vectorized over
+packed uint8 arrays with a popcount lookup table.
+For many-vs-many matrices the shared bits are counted with one matrix
+product of the unpacked bits: |a ^ b| = |a| + |b| - 2 |a & b|.
+"""
+
+import numpy as np
+
+# number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _packed(des):
+    return np.atleast_2d(np.asarray(des, dtype=np.uint8))
+
+
+def popcount(des):
+    """Number of set bits of every descriptor of (N, D) as (N,)"""
+    return POPCOUNT[_packed(des)].sum(axis=1, dtype=np.int32)
+
+
+def hamming_matrix(a, b):
+    """Distances between all descriptors of a (N, D) and b (M, D) as (N, M)"""
+    a, b = _packed(a), _packed(b)
+    # float32 keeps the bit counts (<= 8 * D) exact and runs on BLAS
+    shared = np.unpackbits(a, axis=1).astype(np.float32) @ np.unpackbits(
+        b, axis=1
+    ).astype(np.float32).T
+    ret = popcount(a)[:, None] + popcount(b)[None, :]
+    ret -= 2 * shared.astype(np.int32)
+    return ret
+
+
+def hamming_pairs(a, b):
+    """Row by row distances between a (N, D) and b (N, D) as (N,)"""
+    return POPCOUNT[np.bitwise_xor(_packed(a), _packed(b))].sum(axis=1, dtype=np.int32)
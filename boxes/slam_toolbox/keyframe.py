@@ -0,0 +1,53 @@
+"""
+Keyframe selection.
+Only keyframes are inserted into the Map, the other frames
+are tracked for pose against the last keyframe, so the map
+and bundle adjustment grow with the scene instead of the frame count.
+"""
+
+import numpy as np
+
+
+class KeyframePolicy:
+    """
+    Decides whether a tracked frame becomes a keyframe.
+
+    Args:
+        min_tracked_ratio: insert when fewer of the reference keyframe's
+            map points are tracked in the current frame
+        min_parallax: insert when the median keypoint displacement
+            against the reference keyframe reaches this many pixels
+        max_interval: insert at least every max_interval frames
+    """
+
+    def __init__(self, min_tracked_ratio=0.7, min_parallax=20.0, max_interval=10):
+        self.min_tracked_ratio = min_tracked_ratio
+        self.min_parallax = min_parallax
+        self.max_interval = max_interval
+        self.since_keyframe = 0
+
+    def tracked_ratio(self, ref, idx2):
+        """Share of the reference map points matched in the current frame"""
+        n_map = np.count_nonzero(ref.point_ids >= 0)
+        if not n_map:
+            return 1.0
+        return np.count_nonzero(ref.point_ids[idx2] >= 0) / n_map
+
+    def parallax(self, frame, ref, idx1, idx2):
+        """Median pixel displacement of the matched keypoints"""
+        if not len(idx1):
+            return 0.0
+        return float(
+            np.median(np.linalg.norm(frame.key_pts[idx1] - ref.key_pts[idx2], axis=1))
+        )
+
+    def is_keyframe(self, frame, ref, idx1, idx2):
+        self.since_keyframe += 1
+        ret = (
+            self.since_keyframe >= self.max_interval
+            or self.tracked_ratio(ref, idx2) < self.min_tracked_ratio
+            or self.parallax(frame, ref, idx1, idx2) >= self.min_parallax
+        )
+        if ret:
+            self.since_keyframe = 0
+        return ret
@@ -0,0 +1,149 @@
+"""
+Local mapping in the background.
+Bundle adjustment of the local window runs in a worker process on a
+snapshot of plain arrays (g2o holds the GIL while optimizing, a thread
+would stall tracking just the same). Tracking goes on with the map in the
+meantime, the result is merged back at the next frame boundary once it
+is ready.
+
+Conflicts are settled in favour of the map: frames and points changed
+meanwhile (loop closure, fusion, culling, reused ids) keep their values.
+Keyframes and points created meanwhile were tracked and triangulated
+against the old local window, they follow the correction of its newest
+keyframe rigidly.
+"""
+
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from boxes.slam_toolbox.optimize_g2o import optimize_snapshot
+
+
+class LocalMapping:
+    """
+    One background bundle adjustment at a time, submit starts it and merge
+    applies it to the map when it is done. close stops the worker process,
+    it is also closed at interpreter exit.
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.future = None
+        self.err = 0.0  # error of the last merged optimization
+
+    @property
+    def busy(self):
+        return self.future is not None
+
+    def submit(
+        self, mapp, local_frames, fix_points, rounds=50, solverSE3="EigenSE3", bridge_edges=None
+    ):
+        """
+        Snapshot the local frames, the points they observe and the frames
+        sharing these points (fixed), and optimize them in the worker.
+        """
+        local_ids = {f.id for f in local_frames}
+        ids = np.unique(np.concatenate([f.point_ids for f in local_frames]))
+        ids = ids[ids >= 0]
+        rows, owner = mapp.observation_rows_of(ids)
+        if fix_points:
+            keep = np.isin(mapp.obs_frame[rows], list(local_ids))
+            rows, owner = rows[keep], owner[keep]
+
+        # bridges of the local frames, the other end fixed
+        bridges = [
+            (b["from_id"], b["to_id"], b["rel_pose"], b["info"])
+            for b in bridge_edges or ()
+            if (b["from_id"] in local_ids or b["to_id"] in local_ids)
+            and b["from_id"] in mapp.frames_by_id
+            and b["to_id"] in mapp.frames_by_id
+        ]
+        frame_ids = np.union1d(
+            np.unique(mapp.obs_frame[rows]),
+            list(local_ids) + [fid for b in bridges for fid in b[:2]],
+        ).astype(int)
+        frames = [mapp.frames_by_id[fid] for fid in frame_ids.tolist()]
+        obs_frame = np.searchsorted(frame_ids, mapp.obs_frame[rows])
+        uv = np.empty((len(rows), 2))
+        for k in np.unique(obs_frame).tolist():
+            sel = obs_frame == k
+            uv[sel] = frames[k].kps[mapp.obs_idx[rows[sel]]]
+
+        self.frames = frames
+        self.poses = [f.pose for f in frames]  # the pose setter always makes a new array
+        self.local = np.isin(frame_ids, list(local_ids)) & (frame_ids > 1)
+        self.newest = int(np.flatnonzero(np.isin(frame_ids, list(local_ids)))[-1])
+        self.ids = ids
+        self.positions = mapp.positions[ids].copy()
+        self.alive = mapp.alive[: mapp.n_points].copy()
+        self.max_frame = mapp.max_frame
+        self.fix_points = fix_points
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=1)
+            atexit.register(self.close)
+        self.future = self.pool.submit(
+            optimize_snapshot,
+            dict(
+                frame_ids=frame_ids,
+                poses=np.array(self.poses),
+                fixed=~self.local,
+                positions=np.float64(self.positions),
+                obs_point=owner,
+                obs_frame=obs_frame,
+                uv=uv,
+                bridges=bridges,
+                fix_points=fix_points,
+                rounds=rounds,
+                solverSE3=solverSE3,
+            ),
+        )
+
+    def merge(self, mapp, wait=False):
+        """
+        Apply the finished optimization to the map, returns its error or
+        None when there is nothing to merge yet.
+        """
+        if self.future is None or not (wait or self.future.done()):
+            return None
+        err, poses, positions = self.future.result()
+        self.future = None
+
+        correction = None
+        for k, (f, old, pose) in enumerate(zip(self.frames, self.poses, poses)):
+            if self.local[k] and mapp.frames_by_id.get(f.id) is f and f.pose is old:
+                f.pose = pose
+                if k == self.newest:
+                    # world correction, pose @ correction for frames, its inverse for points
+                    correction = np.linalg.inv(old) @ pose
+
+        # keyframes and points created meanwhile follow the newest local keyframe
+        if correction is not None:
+            for f in mapp.frames:
+                if f.id >= self.max_frame:
+                    f.pose = f.pose @ correction
+            born = mapp.alive[: mapp.n_points].copy()
+            born[: len(self.alive)] &= ~self.alive
+            born = np.flatnonzero(born)
+            inv = np.linalg.inv(correction)
+            mapp.positions[born] = np.float64(mapp.positions[born]) @ inv[:3, :3].T + inv[:3, 3]
+            mapp.touch_points(born)
+
+        # points moved or removed meanwhile keep their map values
+        if not self.fix_points:
+            keep = mapp.alive[self.ids] & (mapp.positions[self.ids] == self.positions).all(axis=1)
+            mapp.positions[self.ids[keep]] = positions[keep]
+            mapp.touch_points(self.ids[keep])
+
+        self.frames = self.poses = None
+        self.err = err
+        return err
+
+    def close(self):
+        """Shut the worker process down, an optimization not merged yet is dropped"""
+        if self.pool is not None:
+            atexit.unregister(self.close)
+            self.pool.shutdown(wait=True, cancel_futures=True)
+        self.pool = self.future = None
+        self.frames = self.poses = None
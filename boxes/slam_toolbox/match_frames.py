@@ -2,7 +2,20 @@
 Match frame
 """
 
-from cv2 import BFMatcher, NORM_HAMMING, findEssentialMat, USAC_MAGSAC, USAC_ACCURATE
+from collections import OrderedDict
+import time
+from cv2 import (
+    FlannBasedMatcher,
+    NORM_HAMMING,
+    CV_32S,
+    batchDistance,
+    findEssentialMat,
+    solvePnPRansac,
+    Rodrigues,
+    SOLVEPNP_ITERATIVE,
+    USAC_MAGSAC,
+    USAC_ACCURATE,
+)
 import numpy as np
 
 # np.set_printoptions(suppress=True)
@@ -11,7 +24,14 @@ from skimage.measure import ransac  # type: ignore
 # from skimage.transform import FundamentalMatrixTransform  # type: ignore
 from skimage.transform import EssentialMatrixTransform  # type: ignore
 
-bf = BFMatcher(NORM_HAMMING)
+from boxes.slam_toolbox.hamming import hamming_pairs
+
+GUIDED_MIN_MATCHES = 50  # fall back to brute force below this
+FLANN_INDEX_LSH = 6
+ESSENTIAL_SAMPLE = 5  # minimal sample of the five point solver
+PNP_MIN_POINTS = 30  # fall back to the essential matrix below this
+PNP_REPROJ_ERROR = 4.0  # pixels
+SBP_CANDIDATES = 4  # keypoints checked around a projected map point
 
 
 def poseRt(R, t):
@@ -39,35 +59,280 @@ def fundamentalRt(F):
     return np.linalg.inv(poseRt(R, t))
 
 
+def knn_match(des1, des2):
+    """
+    Two nearest neighbours in des2 for every descriptor of des1 as (N, 2)
+    distance and index arrays, the same result as BFMatcher(NORM_HAMMING).knnMatch(k=2)
+    without building DMatch objects.
+    """
+    dist, nidx = batchDistance(des1, des2, CV_32S, None, None, NORM_HAMMING, 2)
+    return dist, nidx
+
+
+class DescriptorMatcher:
+    """
+    Matcher that is trained once on the descriptors of a frame (the train
+    side) and reuses that index while the frame is matched again, e.g. a
+    keyframe against all following frames.
+
+    Backends:
+        BF: exact brute force, the index is the contiguous descriptor array
+        LSH: FLANN multi-probe locality sensitive hashing, approximate but
+            sublinear, for nfeatures in the thousands
+    """
+
+    def __init__(
+        self,
+        backend="BF",
+        cache_size=4,
+        table_number=6,
+        key_size=12,
+        multi_probe_level=1,
+    ):
+        self.backend = backend
+        self.cache_size = cache_size
+        self.index_params = dict(
+            algorithm=FLANN_INDEX_LSH,
+            table_number=table_number,
+            key_size=key_size,
+            multi_probe_level=multi_probe_level,
+        )
+        self.search_params = dict(checks=50)
+        self.indexes = OrderedDict()  # id(frame) -> (frame, n, index)
+
+    def index(self, frame):
+        """Trained index of the frame's descriptors, built on first use"""
+        key = id(frame)
+        entry = self.indexes.get(key)
+        # frames may be garbage collected (id reused) or refilled with features
+        n = len(frame.descriptors)
+        if entry is not None and entry[0] is frame and entry[1] == n:
+            self.indexes.move_to_end(key)
+            return entry[2]
+        if self.backend == "LSH":
+            index = FlannBasedMatcher(self.index_params, self.search_params)
+            index.add([frame.descriptors])
+            index.train()
+        else:
+            index = np.ascontiguousarray(frame.descriptors)
+        self.indexes[key] = (frame, n, index)
+        if len(self.indexes) > self.cache_size:
+            self.indexes.popitem(last=False)
+        return index
+
+    def knn_match(self, f1, f2):
+        """
+        Two nearest neighbours in f2 for every descriptor of f1 as (N, 2)
+        distance and index arrays, missing neighbours have index -1.
+        """
+        index = self.index(f2)
+        if self.backend != "LSH":
+            return knn_match(f1.descriptors, index)
+        dist = np.full((len(f1.descriptors), 2), np.iinfo(np.int32).max, np.int32)
+        nidx = np.full((len(f1.descriptors), 2), -1, np.int32)
+        for m in index.knnMatch(f1.descriptors, k=2):
+            for j, n in enumerate(m):
+                dist[n.queryIdx, j] = n.distance
+                nidx[n.queryIdx, j] = n.trainIdx
+        return dist, nidx
+
+    def clear(self):
+        self.indexes.clear()
+
+
+def ratio_test(dist, nidx, ratio=0.75, max_distance=32):
+    """
+    Lowe's ratio test, absolute distance threshold and one-to-one uniqueness
+    (a train keypoint goes to the first query matching it) as array operations.
+    Returns query indices, train indices and distances of the kept matches.
+    """
+    good = (dist[:, 0] < ratio * dist[:, 1]) & (dist[:, 0] < max_distance)
+    idx1 = np.flatnonzero(good)
+    _, first = np.unique(nidx[idx1, 0], return_index=True)
+    idx1 = idx1[np.sort(first)]
+    return idx1, nidx[idx1, 0], dist[idx1, 0]
+
+
+def match_descriptors(f1, f2, matcher=None):
+    """
+    Shared matching core of match_frame and match_frame_USAC.
+    A DescriptorMatcher reuses the trained index of f2.
+    Returns indices into f1, indices into f2 and Hamming distances.
+    """
+    if f1.descriptors is None or f2.descriptors is None or len(f2.descriptors) < 2:
+        empty = np.empty(0, dtype=int)
+        return empty, empty, empty
+    if matcher is None:
+        return ratio_test(*knn_match(f1.descriptors, f2.descriptors))
+    return ratio_test(*matcher.knn_match(f1, f2))
+
+
+def window_match(f1, f2, idx2, preds, radius, ratio=0.75, max_distance=32):
+    """
+    Match keypoints idx2 of f2 only against keypoints of f1 that lie
+    within radius pixels of their predicted positions preds.
+    """
+    cands = f1.kd.query_ball_point(preds, radius)
+    counts = np.array([len(c) for c in cands], dtype=int)
+    if not counts.sum():
+        empty = np.empty(0, dtype=int)
+        return empty, empty, empty
+    q = np.repeat(np.arange(len(idx2)), counts)
+    c = np.concatenate(cands).astype(int)
+    d = hamming_pairs(f2.descriptors[idx2[q]], f1.descriptors[c])
+
+    # best and second best candidate of every query window
+    order = np.lexsort((d, q))
+    q, c, d = q[order], c[order], d[order]
+    _, first = np.unique(q, return_index=True)
+    has_second = np.append(q[first[:-1] + 1] == q[first[:-1]], first[-1] + 1 < len(q))
+    second = np.where(has_second, d[np.minimum(first + 1, len(d) - 1)], np.inf)
+    best = first[(d[first] < ratio * second) & (d[first] < max_distance)]
+
+    # one-to-one: a keypoint of f1 goes to its closest query
+    best = best[np.argsort(d[best], kind="stable")]
+    _, unique = np.unique(c[best], return_index=True)
+    best = np.sort(best[unique])
+    idx1 = c[best]
+    order = np.argsort(idx1)
+    return idx1[order], idx2[q[best]][order], d[best][order]
+
+
+def match_frame_guided(f1, f2, mapp, K, pose_pred, radius=15, matcher=None):
+    """
+    Guided matching with a motion model: map points observed in f2 are
+    projected with the predicted pose of f1 and matched inside a radius,
+    the other keypoints of f2 are searched around their previous position
+    shifted by the median flow, in a window twice as large.
+    Falls back to brute force when too few matches are found.
+    Returns indices into f1, indices into f2 and Hamming distances.
+    """
+    has_pt = f2.point_ids >= 0
+    idx_map, idx_new = np.flatnonzero(has_pt), np.flatnonzero(~has_pt)
+    found = []
+    flow = np.zeros(2)
+    if len(idx_map):
+        pts = np.float64(mapp.positions[f2.point_ids[idx_map]])
+        projs = (pts @ pose_pred[:3, :3].T + pose_pred[:3, 3]) @ K.T
+        front = projs[:, 2] > 0
+        preds = projs[front, 0:2] / projs[front, 2:]
+        found.append(window_match(f1, f2, idx_map[front], preds, radius))
+        if len(found[0][0]):
+            flow = np.median(f1.key_pts[found[0][0]] - f2.key_pts[found[0][1]], axis=0)
+    if len(idx_new):
+        preds = f2.key_pts[idx_new] + flow
+        found.append(window_match(f1, f2, idx_new, preds, 2 * radius))
+
+    if sum(len(m[0]) for m in found) < GUIDED_MIN_MATCHES:
+        return match_descriptors(f1, f2, matcher)
+    idx1, idx2, dist = (np.concatenate(m) for m in zip(*found))
+
+    # the two passes may claim the same keypoint of f1, keep the closest
+    order = np.argsort(dist, kind="stable")
+    _, unique = np.unique(idx1[order], return_index=True)
+    keep = order[unique]
+    return idx1[keep], idx2[keep], dist[keep]
+
+
+def match_local_map(f1, descriptors, positions, K, radius=15):
+    """
+    Match the unassigned keypoints of f1 against the descriptors of the
+    local map in one batched query. Matches are kept when the point
+    reprojects with the pose of f1 within radius pixels of the keypoint.
+    Returns indices into f1 and indices into the local map points.
+    """
+    free = np.flatnonzero(f1.point_ids < 0)
+    if descriptors is None or len(descriptors) < 2 or not len(free):
+        empty = np.empty(0, dtype=int)
+        return empty, empty
+    idx_q, idx_p, _ = ratio_test(*knn_match(f1.descriptors[free], descriptors))
+    idx1 = free[idx_q]
+    projs = (K @ (f1.pose[:3, :3] @ positions[idx_p].T + f1.pose[:3, 3:])).T
+    front = projs[:, 2] > 0
+    err = np.linalg.norm(projs[:, 0:2] / projs[:, 2:] - f1.key_pts[idx1], axis=1)
+    good = front & (err < radius)
+    return idx1[good], idx_p[good]
+
+
+def search_by_projection(f1, mapp, K, W, H, max_distance=64, radius=2):
+    """
+    Match the map points not observed in f1 to its free keypoints. All the
+    points are projected at once, the keypoints within radius pixels are
+    found by one batched KD-tree query (at most SBP_CANDIDATES nearest) and the descriptor distance of a
+    candidate is the minimum over the observations of the point.
+    Every point takes its closest candidate, a keypoint claimed by several
+    points goes to the closest one.
+    Returns indices into f1 and the matched points.
+    """
+    empty = np.empty(0, dtype=int)
+    ids = mapp.alive_ids()
+    if not len(ids):
+        return empty, []
+    pts = np.float64(mapp.positions[ids])
+
+    # project *all* the map points into the current frame
+    projs = (pts @ f1.pose[:3, :3].T + f1.pose[:3, 3]) @ K.T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        projs = projs[:, 0:2] / projs[:, 2:]
+    vis = np.flatnonzero(
+        (projs[:, 0] > 0)
+        & (projs[:, 0] < W)
+        & (projs[:, 1] > 0)
+        & (projs[:, 1] < H)
+        & ~np.isin(ids, f1.point_ids)
+    )
+    if not len(vis):
+        return empty, []
+
+    # free keypoints around the projections
+    _, cands = f1.kd.query(projs[vis], k=SBP_CANDIDATES, distance_upper_bound=radius)
+    found = cands < len(f1.key_pts)
+    q = np.broadcast_to(vis[:, None], cands.shape)[found]
+    c = cands[found]
+    free = f1.point_ids[c] < 0
+    q, c = q[free], c[free]
+    if not len(q):
+        return empty, []
+
+    # every candidate pair against all the observations of its point
+    uq, inv = np.unique(q, return_inverse=True)
+    obs_rows, owner = mapp.observation_rows_of(ids[uq])
+    n_obs = np.bincount(owner, minlength=len(uq))
+    obs_des = mapp.observation_descriptors(obs_rows)
+    obs_start = np.cumsum(n_obs) - n_obs
+    pair_n = n_obs[inv]
+    pair_start = np.cumsum(pair_n) - pair_n
+    pair = np.repeat(np.arange(len(q)), pair_n)
+    obs_idx = np.repeat(obs_start[inv] - pair_start, pair_n) + np.arange(len(pair))
+    d = hamming_pairs(obs_des[obs_idx], f1.descriptors[c[pair]])
+    dist = np.minimum.reduceat(d, pair_start)
+
+    good = dist < max_distance
+    q, c, dist = q[good], c[good], dist[good]
+
+    # closest candidate of every point, then closest point of every keypoint
+    order = np.lexsort((dist, q))
+    _, first = np.unique(q[order], return_index=True)
+    best = order[first]
+    best = best[np.argsort(dist[best], kind="stable")]
+    _, unique = np.unique(c[best], return_index=True)
+    best = np.sort(best[unique])
+    return c[best], [mapp.points_by_id[i] for i in ids[q[best]].tolist()]
+
+
 def match_frame(f1, f2, m_samples=8, r_threshold=0.01, m_trials=300):
     """
     Match keypoints between two frames and estimate relative pose using Essential matrix.
     Returns indices of inliers and relative pose (4x4 SE3).
     """
-    matches = bf.knnMatch(f1.descriptors, f2.descriptors, k=2)
-
-    ret = []
-    idx1, idx2 = [], []
-    idx1s, idx2s = set(), set()
-
-    for m, n in matches:
-        if m.distance < 0.75 * n.distance and m.distance < 32:
-            p1 = f1.kps[m.queryIdx]
-            p2 = f2.kps[m.trainIdx]
-            if m.queryIdx not in idx1s and m.trainIdx not in idx2s:
-                idx1.append(m.queryIdx)
-                idx2.append(m.trainIdx)
-                idx1s.add(m.queryIdx)
-                idx2s.add(m.trainIdx)
-                ret.append((p1, p2))
+    idx1, idx2, _ = match_descriptors(f1, f2)
 
     # Check for minimal number of matches
-    if len(ret) < 8:
-        print(f"[WARN] Too few matches: {len(ret)} (need >= 8). Skipping frame.")
+    if len(idx1) < 8:
+        print(f"[WARN] Too few matches: {len(idx1)} (need >= 8). Skipping frame.")
         return None, None, None
 
-    ret = np.array(ret)
-    idx1, idx2 = np.array(idx1), np.array(idx2)
+    ret = np.stack([f1.kps[idx1], f2.kps[idx2]], axis=1)
 
     try:
         model, inliers = ransac(
@@ -92,31 +357,96 @@ def match_frame_USAC(f1, f2, m_samples=8, r_threshold=0.01, m_trials=300, method
     Match keypoints between two frames and estimate relative pose using Essential matrix.
     Returns indices of inliers and relative pose (4x4 SE3).
     """
-    matches = bf.knnMatch(f1.descriptors, f2.descriptors, k=2)
- 
-    ret = []
-    idx1, idx2 = [], []
-    idx1s, idx2s = set(), set()
- 
-    for m, n in matches:
-        if m.distance < 0.75 * n.distance and m.distance < 32:
-            p1 = f1.kps[m.queryIdx]
-            p2 = f2.kps[m.trainIdx]
-            if m.queryIdx not in idx1s and m.trainIdx not in idx2s:
-                idx1.append(m.queryIdx)
-                idx2.append(m.trainIdx)
-                idx1s.add(m.queryIdx)
-                idx2s.add(m.trainIdx)
-                ret.append((p1, p2))
+    idx1, idx2, _ = match_descriptors(f1, f2)
  
+    return estimate_pose_USAC(f1, f2, idx1, idx2, r_threshold, m_trials, method_r)
+
+
+def ransac_iterations(inlier_ratio, confidence=0.9999, sample_size=ESSENTIAL_SAMPLE):
+    """Trials needed to draw one all inlier sample with the given confidence"""
+    w = inlier_ratio**sample_size
+    if w <= 0.0:
+        return np.inf
+    if w >= 1.0:
+        return 1
+    return int(np.ceil(np.log(1.0 - confidence) / np.log(1.0 - w)))
+
+
+class RansacBudget:
+    """
+    Adaptive iteration budget of the pose estimation. The inlier ratio of
+    the last frame predicts the trials needed for the current one, with a
+    safety margin, between min_trials and max_trials. After a failure the
+    full budget is used again. Not adaptive, max_trials is always used and
+    the budget only keeps the statistics.
+    Keeps the iteration cap given to the last estimation as last_cap
+    (OpenCV does not report how many iterations it ran before stopping
+    early), the trials its inlier ratio needed and its time for reporting.
+    """
+
+    def __init__(
+        self, max_trials=300, min_trials=20, confidence=0.9999, margin=0.9, adaptive=True
+    ):
+        self.max_trials = max_trials
+        self.min_trials = min_trials
+        self.confidence = confidence
+        self.margin = margin
+        self.adaptive = adaptive
+        self.inlier_ratio = None
+        self.last_cap = max_trials
+        self.needed = max_trials
+        self.time = 0.0
+
+    def trials(self):
+        if not self.adaptive or self.inlier_ratio is None:
+            return self.max_trials
+        needed = ransac_iterations(self.margin * self.inlier_ratio, self.confidence)
+        return int(np.clip(needed, self.min_trials, self.max_trials))
+
+    def update(self, n_matches, n_inliers, elapsed):
+        self.time = elapsed
+        if not n_matches or n_inliers < 8:
+            self.inlier_ratio = None
+            self.needed = self.max_trials
+            return
+        self.inlier_ratio = n_inliers / n_matches
+        self.needed = min(ransac_iterations(self.inlier_ratio, self.confidence), self.max_trials)
+
+
+def estimate_pose_USAC(
+    f1,
+    f2,
+    idx1,
+    idx2,
+    r_threshold=0.01,
+    m_trials=300,
+    method_r=USAC_ACCURATE,
+    dist=None,
+    budget=None,
+):
+    """
+    Estimate relative pose using Essential matrix from known correspondences
+    (descriptor matches or KLT tracks).
+    With descriptor distances the correspondences are passed best first,
+    as USAC_PROSAC expects. A RansacBudget gives the iteration count in
+    place of m_trials and records the iteration cap and time of the estimation.
+    Returns indices of inliers and relative pose (4x4 SE3).
+    """
     # Check for minimal number of matches
-    if len(ret) < 8:
-        print(f"[WARN] Too few matches: {len(ret)} (need >= 8). Skipping frame.")
+    if len(idx1) < 8:
+        print(f"[WARN] Too few matches: {len(idx1)} (need >= 8). Skipping frame.")
+        if budget is not None:
+            budget.update(len(idx1), 0, 0.0)
         return None, None, None
- 
-    ret = np.array(ret)
-    idx1, idx2 = np.array(idx1), np.array(idx2)
- 
+
+    order = np.arange(len(idx1)) if dist is None else np.argsort(dist, kind="stable")
+    if budget is not None:
+        m_trials = budget.trials()
+        budget.last_cap = m_trials
+
+    ret = np.stack([f1.kps[idx1[order]], f2.kps[idx2[order]]], axis=1)
+
+    start_time = time.perf_counter()
     try:
         E, mask = findEssentialMat(
             ret[:, 0].reshape(-1, 1, 2).astype(np.float64),
@@ -128,13 +458,128 @@ def match_frame_USAC(f1, f2, m_samples=8, r_threshold=0.01, m_trials=300, method
             maxIters=m_trials,
         )
         model = E[:3, :]
-        inliers = mask.ravel().astype(bool)
+        # back to the order of the matches
+        inliers = np.empty(len(idx1), dtype=bool)
+        inliers[order] = mask.ravel().astype(bool)
     except Exception as e:
         print(f"[WARN] RANSAC failed: {e}")
+        inliers = None
+    if budget is not None:
+        n_inliers = 0 if inliers is None else np.sum(inliers)
+        budget.update(len(idx1), n_inliers, time.perf_counter() - start_time)
+
+    if inliers is None:
         return None, None, None
- 
-    if inliers is None or np.sum(inliers) < 8:
+
+    if np.sum(inliers) < 8:
         print(f"[WARN] Not enough inliers after RANSAC: {np.sum(inliers)}")
         return None, None, None
- 
+
     return idx1[inliers], idx2[inliers], fundamentalRt(model)
+
+
+def sampson_distance(E, x1, x2):
+    """Sampson distance of normalized correspondences x1 ~ E x2"""
+    x1 = np.concatenate([x1, np.ones((len(x1), 1))], axis=1)
+    x2 = np.concatenate([x2, np.ones((len(x2), 1))], axis=1)
+    Ex2 = x2 @ E.T
+    Etx1 = x1 @ E
+    num = np.sum(x1 * Ex2, axis=1) ** 2
+    den = Ex2[:, 0] ** 2 + Ex2[:, 1] ** 2 + Etx1[:, 0] ** 2 + Etx1[:, 1] ** 2
+    return num / np.maximum(den, 1e-12)
+
+
+def estimate_pose_PnP(f1, f2, mapp, K, idx1, idx2, r_threshold=0.01, m_trials=100):
+    """
+    Track the pose of f1 against the map: matches to map points observed
+    in f2 give 2D-3D correspondences for solvePnPRansac, starting from the
+    pose of f2. The other matches are kept when they agree with the
+    epipolar geometry of the estimated pose, for triangulation.
+    Returns indices of inliers and relative pose (4x4 SE3), or Nones when
+    too few map points are matched and the essential matrix is needed.
+    """
+    has_pt = f2.point_ids[idx2] >= 0
+    if np.count_nonzero(has_pt) < PNP_MIN_POINTS:
+        return None, None, None
+    pts3d = np.float64(mapp.positions[f2.point_ids[idx2[has_pt]]])
+    pts2d = f1.key_pts[idx1[has_pt]].astype(np.float64)
+
+    rvec, _ = Rodrigues(f2.pose[:3, :3])
+    tvec = f2.pose[:3, 3].copy()
+    ok, rvec, tvec, inl = solvePnPRansac(
+        pts3d,
+        pts2d,
+        K,
+        None,
+        rvec,
+        tvec,
+        useExtrinsicGuess=True,
+        iterationsCount=m_trials,
+        reprojectionError=PNP_REPROJ_ERROR,
+        confidence=0.9999,
+        flags=SOLVEPNP_ITERATIVE,
+    )
+    if not ok or inl is None or len(inl) < PNP_MIN_POINTS:
+        return None, None, None
+    pose = poseRt(Rodrigues(rvec)[0], tvec.ravel())
+    Rt = pose @ f2.pose_inv
+
+    inliers = np.zeros(len(idx1), dtype=bool)
+    inliers[np.flatnonzero(has_pt)[inl.ravel()]] = True
+    new = np.flatnonzero(~has_pt)
+    if len(new):
+        t = Rt[:3, 3]
+        tx = np.array([[0, -t[2], t[1]], [t[2], 0, -t[0]], [-t[1], t[0], 0]])
+        E = tx @ Rt[:3, :3]
+        d = sampson_distance(E, f1.kps[idx1[new]], f2.kps[idx2[new]])
+        inliers[new] = d < r_threshold**2
+    return idx1[inliers], idx2[inliers], Rt
+
+
+def relocalize(f1, mapp, K, matcher=None, r_threshold=0.01, m_trials=100, n_candidates=5):
+    """
+    Recover the pose of a frame after tracking loss: the keyframes most
+    similar to it in mapp.keyframe_db are matched in turn and the first one
+    verified with PnP against its map points gives the pose.
+    Returns indices of inliers, world to camera pose and the keyframe,
+    or Nones when no candidate is verified.
+    """
+    candidates = mapp.keyframe_db.query(f1.descriptors, n_candidates, exclude=(f1.id,))
+    return verify_candidates(f1, mapp, K, [fid for fid, _ in candidates], matcher, r_threshold, m_trials)
+
+
+def detect_loop(f1, mapp, K, matcher=None, r_threshold=0.01, m_trials=100, min_gap=30, n_candidates=3):
+    """
+    Loop closure of a keyframe: candidates are keyframes at least min_gap
+    ids older that are not covisible with it and score at least as well
+    as its least similar covisible keyframe, verified with PnP against
+    their map points like the relocalization.
+    Returns indices of inliers, world to camera pose in the coordinates of
+    the loop keyframe and the loop keyframe, or Nones.
+    """
+    neighbours = mapp.covisibility[f1.id]
+    if not neighbours:
+        return None, None, None, None
+    scores = dict(mapp.keyframe_db.query(f1.descriptors, len(mapp.keyframe_db), exclude=(f1.id,)))
+    min_score = min(scores.get(fid, 0.0) for fid in neighbours)
+    candidates = [
+        fid
+        for fid, score in scores.items()
+        if score >= min_score and fid <= f1.id - min_gap and fid not in neighbours
+    ]
+    return verify_candidates(
+        f1, mapp, K, candidates[:n_candidates], matcher, r_threshold, m_trials
+    )
+
+
+def verify_candidates(f1, mapp, K, candidates, matcher, r_threshold, m_trials):
+    """First keyframe of candidates (ids) that PnP verifies with its map points"""
+    for fid in candidates:
+        if fid not in mapp.frames_by_id and mapp.atlas is not None and mapp.atlas.spilled(fid):
+            mapp.atlas.page_in(mapp, mapp.atlas.submap(fid))
+        kf = mapp.frames_by_id[fid]
+        idx1, idx2, _ = match_descriptors(f1, kf, matcher)
+        inl1, inl2, Rt = estimate_pose_PnP(f1, kf, mapp, K, idx1, idx2, r_threshold, m_trials)
+        if Rt is not None:
+            return inl1, inl2, Rt @ kf.pose, kf
+    return None, None, None, None
@@ -27,17 +27,19 @@ def add_bridge_edge(optimizer, from_id, to_id, rel_pose, info):
     edge.set_measurement(iso)
     edge.set_information(info)
     optimizer.add_edge(edge)
+    return edge
 
 
 def optimize(
     frames,
-    points,
+    mapp,
     local_window,
     fix_points,
     verbose=False,
     rounds=50,
     solverSE3="EigenSE3",
     bridge_edges=None,
+    local_frames=None,
 ):
     """
     Perform bundle adjustment optimization using g2o with partial vectorization
@@ -45,25 +47,25 @@ def optimize(
 
     Args:
         frames: List of all frames (each must have .id, .pose, .kps)
-        points: List of all 3D points (each must have .id, .pt, .frames, .idxs)
+        mapp: Map with the point columns and observation rows
         local_window: Number of recent frames to optimize (None = all)
         fix_points: Keep 3D points fixed during optimization
         verbose: Enable verbose output
         rounds: Number of optimization iterations
         solverSE3: Linear solver type
         bridge_edges: List of bridge constraints from sliding window
+        local_frames: Frames to optimize instead of the temporal window
 
     Returns:
         float: Final chi2 error
     """
 
     # Select frames for optimization
-    if local_window is None:
-        local_frames = frames
-    else:
-        local_frames = frames[-local_window:]
+    if local_frames is None:
+        local_frames = frames if local_window is None else frames[-local_window:]
 
     local_ids = {f.id for f in local_frames}
+    frames_by_id = {f.id: f for f in frames}
 
     # Create optimizer
     optimizer = g2o.SparseOptimizer()
@@ -80,9 +82,7 @@ def optimize(
     robust_kernel = g2o.RobustKernelHuber(np.sqrt(5.991))
     info_matrix = np.eye(2)
 
-    # Precompute: dictionary for frame keypoints for faster access
-    frame_kps = {f.id: np.array(f.kps) for f in frames}
-    graph_frames, graph_points = {}, {}
+    graph_frames = {}
 
     # Add frame vertices
     for f in (local_frames if fix_points else frames):
@@ -96,30 +96,40 @@ def optimize(
         optimizer.add_vertex(v_se3)
         graph_frames[f.id] = v_se3
 
-    # Pre-filter points that are seen in the local window
-    filtered_points = [
-        p for p in points if any(fr.id in local_ids for fr in p.frames)
-    ]
+    # Points seen in the local window, from the observation columns
+    rows = np.flatnonzero(mapp.obs_alive[: mapp.n_obs])
+    in_graph = np.zeros(mapp.max_frame + 1, dtype=bool)
+    in_graph[list(graph_frames)] = True
+    rows = rows[in_graph[mapp.obs_frame[rows]]]
+    ids = np.unique(mapp.obs_point[rows[np.isin(mapp.obs_frame[rows], list(local_ids))]])
+    selected = np.zeros(mapp.n_points, dtype=bool)
+    selected[ids] = True
+    rows = rows[selected[mapp.obs_point[rows]]]
 
-    # Add 3D point vertices and projection edges
-    for p in filtered_points:
+    # Add 3D point vertices
+    graph_points = []
+    for pid, loc in zip(ids.tolist(), np.float64(mapp.positions[ids])):
         pt = g2o.VertexPointXYZ()
-        pt.set_id(p.id * 2 + 1)
-        pt.set_estimate(p.pt[:3])
+        pt.set_id(pid * 2 + 1)
+        pt.set_estimate(loc)
         pt.set_marginalized(True)
         pt.set_fixed(fix_points)
         optimizer.add_vertex(pt)
-        graph_points[p] = pt
+        graph_points.append(pt)
 
-        # Fast zip over frame references and keypoint indices
-        for f, idx in zip(p.frames, p.idxs):
-            if f.id not in graph_frames:
-                continue
+    # Add projection edges straight from the observation rows, frame by frame
+    point_pos = np.searchsorted(ids, mapp.obs_point[rows])
+    obs_frame = mapp.obs_frame[rows]
+    for fid in np.unique(obs_frame).tolist():
+        sel = obs_frame == fid
+        v_se3 = graph_frames[fid]
+        kps = frames_by_id[fid].kps[mapp.obs_idx[rows[sel]]]
+        for pos, uv in zip(point_pos[sel].tolist(), kps):
             edge = g2o.EdgeProjectXYZ2UV()
             edge.set_parameter_id(0, 0)
-            edge.set_vertex(0, pt)
-            edge.set_vertex(1, graph_frames[f.id])
-            edge.set_measurement(frame_kps[f.id][idx])
+            edge.set_vertex(0, graph_points[pos])
+            edge.set_vertex(1, v_se3)
+            edge.set_measurement(uv)
             edge.set_information(info_matrix)
             edge.set_robust_kernel(robust_kernel)
             optimizer.add_edge(edge)
@@ -148,19 +158,290 @@ def optimize(
     # Final error
     final_error = optimizer.active_chi2()
 
-    # Batch update frame poses using NumPy for compactness
+    # Update frame poses through the id -> frame lookup
     for fid, vertex in graph_frames.items():
         est = vertex.estimate()
-        R = est.rotation().matrix()
-        t = est.translation()
-        for fr in frames:
-            if fr.id == fid:
-                fr.pose = poseRt(R, t)
-                break
+        frames_by_id[fid].pose = poseRt(est.rotation().matrix(), est.translation())
 
     # Batch update 3D points (if not fixed)
-    if not fix_points:
-        for p, vertex in graph_points.items():
-            p.pt = np.array(vertex.estimate())
+    if not fix_points and len(ids):
+        mapp.positions[ids] = np.array([pt.estimate() for pt in graph_points])
 
     return final_error
+
+
+def observation_keys(obs_frame, obs_idx):
+    """Key of observations, frame id << 24 | keypoint index"""
+    return np.asarray(obs_frame, dtype=np.int64) << 24 | obs_idx
+
+
+class IncrementalOptimizer:
+    """
+    Bundle adjustment graph kept across calls, it lives on the Map.
+
+    The graph holds every resident keyframe and alive point with their
+    projection edges, vertex ids are frame id * 2 and point id * 2 + 1 like
+    in optimize. Each call brings the graph up to date with the changes the
+    map recorded since the last call (Map.touch_points, the removed
+    observation keys and the rows past Map.synced_obs): vertices and edges of
+    removed (marginalized, spilled, culled) frames and points are removed,
+    new ones are added and estimates are only reset where the map moved them,
+    so the optimization warm starts from the last result and the cost scales
+    with what changed. The local window is selected with
+    initialize_optimization on its vertex set.
+    """
+
+    def __init__(self, solverSE3="EigenSE3"):
+        self.solverSE3 = solverSE3
+        self.optimizer = g2o.SparseOptimizer()
+        solver = g2o.BlockSolverSE3(SolverSE3[solverSE3]())
+        self.optimizer.set_algorithm(g2o.OptimizationAlgorithmLevenberg(solver))
+        cam = g2o.CameraParameters(1.0, (0.0, 0.0), 0)
+        cam.set_id(0)
+        self.optimizer.add_parameter(cam)
+        self.robust_kernel = g2o.RobustKernelHuber(np.sqrt(5.991))
+        self.info_matrix = np.eye(2)
+
+        self.frames = {}  # frame id -> vertex
+        self.poses = {}  # frame id -> pose of the vertex estimate
+        self.points = {}  # point id -> vertex
+        self.edges = {}  # observation key -> projection edge
+        self.bridges = {}  # (from id, to id) -> edge
+
+    def _add_frame(self, frame):
+        v_se3 = g2o.VertexSE3Expmap()
+        v_se3.set_id(frame.id * 2)
+        self.optimizer.add_vertex(v_se3)
+        self.frames[frame.id] = v_se3
+
+    def _add_point(self, pid):
+        pt = g2o.VertexPointXYZ()
+        pt.set_id(pid * 2 + 1)
+        pt.set_marginalized(True)
+        self.optimizer.add_vertex(pt)
+        self.points[pid] = pt
+
+    def _add_edge(self, key, pid, frame, uv):
+        edge = g2o.EdgeProjectXYZ2UV()
+        edge.set_parameter_id(0, 0)
+        edge.set_vertex(0, self.points[pid])
+        edge.set_vertex(1, self.frames[frame])
+        edge.set_measurement(uv)
+        edge.set_information(self.info_matrix)
+        edge.set_robust_kernel(self.robust_kernel)
+        self.optimizer.add_edge(edge)
+        self.edges[key] = edge
+
+    def sync(self, mapp, bridge_edges=None):
+        """
+        Apply the changes the map recorded since the last call to the graph:
+        removed observation keys, touched points and observation rows from
+        mapp.synced_obs on.
+        """
+        # edges of removed observations
+        if mapp.removed_keys:
+            for key in np.unique(np.concatenate(mapp.removed_keys)).tolist():
+                edge = self.edges.pop(key, None)
+                if edge is not None:
+                    self.optimizer.remove_edge(edge)
+        bridges = {
+            (b["from_id"], b["to_id"]): b
+            for b in bridge_edges or ()
+            if b["from_id"] in mapp.frames_by_id and b["to_id"] in mapp.frames_by_id
+        }
+        for key in [k for k in self.bridges if k not in bridges]:
+            self.optimizer.remove_edge(self.bridges.pop(key))
+
+        # frames
+        for fid in [fid for fid in self.frames if fid not in mapp.frames_by_id]:
+            self.optimizer.remove_vertex(self.frames.pop(fid))
+            del self.poses[fid]
+        for f in mapp.frames:
+            if f.id not in self.frames:
+                self._add_frame(f)
+            elif self.poses[f.id] is f.pose:  # the pose setter always makes a new array
+                continue
+            self.frames[f.id].set_estimate(g2o.SE3Quat(f.pose[0:3, 0:3], f.pose[0:3, 3]))
+            self.poses[f.id] = f.pose
+
+        # points added, moved or removed
+        if mapp.touched_points:
+            touched = np.unique(np.concatenate(mapp.touched_points))
+            alive = mapp.alive[touched]
+            for pid in touched[~alive].tolist():
+                vertex = self.points.pop(pid, None)
+                if vertex is not None:
+                    self.optimizer.remove_vertex(vertex)
+            for pid in touched[alive].tolist():
+                if pid not in self.points:
+                    self._add_point(pid)
+                self.points[pid].set_estimate(np.float64(mapp.positions[pid]))
+
+        # edges of new observations, measurements from the keypoints of every frame
+        rows = mapp.synced_obs + np.flatnonzero(mapp.obs_alive[mapp.synced_obs : mapp.n_obs])
+        fids = mapp.obs_frame[rows]
+        for fid in np.unique(fids).tolist():
+            sel = rows[fids == fid]
+            keys = observation_keys(mapp.obs_frame[sel], mapp.obs_idx[sel])
+            kps = mapp.frames_by_id[fid].kps[mapp.obs_idx[sel]]
+            for key, pid, uv in zip(keys.tolist(), mapp.obs_point[sel].tolist(), kps):
+                self._add_edge(key, pid, fid, uv)
+        mapp.synced_obs, mapp.removed_keys, mapp.touched_points = mapp.n_obs, [], []
+
+        for key, b in bridges.items():
+            if key not in self.bridges:
+                self.bridges[key] = add_bridge_edge(
+                    self.optimizer, b["from_id"], b["to_id"], b["rel_pose"], b["info"]
+                )
+
+    def optimize(
+        self, mapp, local_frames, fix_points, verbose=False, rounds=50, bridge_edges=None
+    ):
+        """
+        Optimize the local frames and the points they observe, frames
+        sharing these points are fixed. Returns the final chi2 error.
+        """
+        self.sync(mapp, bridge_edges)
+        local_ids = {f.id for f in local_frames}
+        ids = np.unique(np.concatenate([f.point_ids for f in local_frames]))
+        ids = ids[ids >= 0]
+        fids = set(local_ids)
+        if not fix_points:
+            rows, _ = mapp.observation_rows_of(ids)
+            fids.update(np.unique(mapp.obs_frame[rows]).tolist())
+            # bridges of the local frames, the other end fixed
+            fids.update(k for key in self.bridges if local_ids.intersection(key) for k in key)
+
+        vset = set()
+        for fid in fids:
+            self.frames[fid].set_fixed(fid <= 1 or fid not in local_ids)
+            vset.add(self.frames[fid])
+        for pid in ids.tolist():
+            self.points[pid].set_fixed(fix_points)
+            vset.add(self.points[pid])
+
+        self.optimizer.set_verbose(verbose)
+        self.optimizer.initialize_optimization(vset)
+        self.optimizer.optimize(rounds)
+        final_error = self.optimizer.active_chi2()
+
+        for fid in local_ids:
+            est = self.frames[fid].estimate()
+            frame = mapp.frames_by_id[fid]
+            frame.pose = poseRt(est.rotation().matrix(), est.translation())
+            self.poses[fid] = frame.pose
+        if not fix_points and len(ids):
+            mapp.positions[ids] = np.array([self.points[pid].estimate() for pid in ids.tolist()])
+        return final_error
+
+
+def optimize_snapshot(snapshot):
+    """
+    Bundle adjustment on plain arrays, run by the local mapping process.
+
+    Args:
+        snapshot: dict with frame_ids (F,), poses (F, 4, 4), fixed (F,),
+            positions (P, 3), obs_point and obs_frame (E,) indices into the
+            points and frames, uv (E, 2) normalized keypoints, bridges as
+            (from_id, to_id, rel_pose, info), fix_points, rounds, solverSE3
+
+    Returns:
+        tuple: (final chi2 error, poses (F, 4, 4), positions (P, 3))
+    """
+    optimizer = g2o.SparseOptimizer()
+    solver = g2o.BlockSolverSE3(SolverSE3[snapshot["solverSE3"]]())
+    solver = g2o.OptimizationAlgorithmLevenberg(solver)
+    optimizer.set_algorithm(solver)
+
+    cam = g2o.CameraParameters(1.0, (0.0, 0.0), 0)
+    cam.set_id(0)
+    optimizer.add_parameter(cam)
+    robust_kernel = g2o.RobustKernelHuber(np.sqrt(5.991))
+    info_matrix = np.eye(2)
+
+    frames = []
+    for fid, pose, fixed in zip(
+        snapshot["frame_ids"].tolist(), snapshot["poses"], snapshot["fixed"].tolist()
+    ):
+        v_se3 = g2o.VertexSE3Expmap()
+        v_se3.set_estimate(g2o.SE3Quat(pose[0:3, 0:3], pose[0:3, 3]))
+        v_se3.set_id(fid * 2)
+        v_se3.set_fixed(fixed)
+        optimizer.add_vertex(v_se3)
+        frames.append(v_se3)
+
+    points = []
+    for i, loc in enumerate(snapshot["positions"]):
+        pt = g2o.VertexPointXYZ()
+        pt.set_id(i * 2 + 1)
+        pt.set_estimate(loc)
+        pt.set_marginalized(True)
+        pt.set_fixed(snapshot["fix_points"])
+        optimizer.add_vertex(pt)
+        points.append(pt)
+
+    for p, f, uv in zip(snapshot["obs_point"].tolist(), snapshot["obs_frame"].tolist(), snapshot["uv"]):
+        edge = g2o.EdgeProjectXYZ2UV()
+        edge.set_parameter_id(0, 0)
+        edge.set_vertex(0, points[p])
+        edge.set_vertex(1, frames[f])
+        edge.set_measurement(uv)
+        edge.set_information(info_matrix)
+        edge.set_robust_kernel(robust_kernel)
+        optimizer.add_edge(edge)
+
+    for from_id, to_id, rel_pose, info in snapshot["bridges"]:
+        add_bridge_edge(optimizer, from_id, to_id, rel_pose, info)
+
+    optimizer.initialize_optimization()
+    optimizer.optimize(snapshot["rounds"])
+
+    poses = np.array(
+        [poseRt(v.estimate().rotation().matrix(), v.estimate().translation()) for v in frames]
+    )
+    positions = np.array([pt.estimate() for pt in points]).reshape(-1, 3)
+    return optimizer.active_chi2(), poses, positions
+
+
+def optimize_pose_graph(frames, edges, fixed_ids, rounds=20, solverSE3="EigenSE3", verbose=False):
+    """
+    Pose graph optimization over keyframe SE3 vertices only, no points.
+
+    Args:
+        frames: Keyframes, their poses are the vertices
+        edges: (from_id, to_id, rel_pose, info) constraints like the bridge
+            edges, rel_pose = pose_inv of from_id @ pose of to_id
+        fixed_ids: Ids of the frames kept fixed
+        rounds: Number of optimization iterations
+        solverSE3: Linear solver type
+        verbose: Enable verbose output
+
+    Returns:
+        float: Final chi2 error
+    """
+    optimizer = g2o.SparseOptimizer()
+    solver = g2o.BlockSolverSE3(SolverSE3[solverSE3]())
+    solver = g2o.OptimizationAlgorithmLevenberg(solver)
+    optimizer.set_algorithm(solver)
+
+    vertices = {}
+    for f in frames:
+        v_se3 = g2o.VertexSE3()
+        v_se3.set_estimate(g2o.Isometry3d(f.pose[:3, :3], f.pose[:3, 3]))
+        v_se3.set_id(f.id * 2)
+        v_se3.set_fixed(f.id in fixed_ids)
+        optimizer.add_vertex(v_se3)
+        vertices[f.id] = v_se3
+
+    for from_id, to_id, rel_pose, info in edges:
+        add_bridge_edge(optimizer, from_id, to_id, rel_pose, info)
+
+    optimizer.set_verbose(verbose)
+    optimizer.initialize_optimization()
+    optimizer.optimize(rounds)
+
+    for f in frames:
+        if f.id not in fixed_ids:
+            f.pose = vertices[f.id].estimate().matrix()
+
+    return optimizer.active_chi2()
@@ -2,35 +2,73 @@
 Description of the point and location map
 """
 
+from collections import Counter, defaultdict
+import time
 import numpy as np
 
-from boxes.slam_toolbox.optimize_g2o import optimize
+from boxes.slam_toolbox.optimize_g2o import (
+    IncrementalOptimizer,
+    observation_keys,
+    optimize,
+    optimize_pose_graph,
+)
+from boxes.slam_toolbox.hamming import hamming_matrix, hamming_pairs
+from boxes.slam_toolbox.voxel_hash import PointHash
+from boxes.slam_toolbox.frame import concat_packed, normalize, pack_frames, unpack_frames
+from boxes.slam_toolbox.local_mapping import LocalMapping
 
 CULLING_ERR_THRES = 0.02
+MAP_FORMAT_VERSION = 1
 
 def hamming_distance(a, b):
-    r = (1 << np.arange(8))[:, None]
-    return np.count_nonzero((np.bitwise_xor(a, b) & r) != 0)
+    return int(hamming_pairs(a, b)[0])
 
 
 class Point:
     """
     A 3D point in the world coordinate system.
     Each point is observed in multiple frames.
+    The point is a view on the columns of the Map, indexed by its id.
     """
 
+    __slots__ = ("mapp", "id")
+
     def __init__(self, mapp, loc, color, tid=None):
-        self.pt = np.array(loc)
-        self.frames = []
-        self.idxs = []
-        self.color = np.copy(color)
-        self.id = tid if tid is not None else mapp.add_point(self)
+        self.mapp = mapp
+        # with tid the columns of the point are already in the map
+        self.id = tid if tid is not None else mapp.add_point(self, loc, color)
+
+    @property
+    def pt(self):
+        return self.mapp.positions[self.id]
+
+    @pt.setter
+    def pt(self, loc):
+        self.mapp.positions[self.id] = loc
+        self.mapp.touch_points([self.id])
+
+    @property
+    def color(self):
+        return self.mapp.colors[self.id]
+
+    @color.setter
+    def color(self, color):
+        self.mapp.colors[self.id] = color
+
+    @property
+    def frames(self):
+        """Frames observing the point, in observation order"""
+        fids, _ = self.mapp.observations_of(self.id)
+        return [self.mapp.frames_by_id[fid] for fid in fids]
+
+    @property
+    def idxs(self):
+        """Keypoint indices of the observations, in observation order"""
+        return self.mapp.observations_of(self.id)[1].tolist()
 
     def homogeneous(self):
         """Convert point to homogeneous coordinates."""
-        if len(self.pt.shape) == 1:
-            return np.concatenate([self.pt, np.array([1.0])], axis=0)
-        return np.concatenate([self.pt, np.ones((self.pt.shape[0], 1))], axis=1)
+        return np.append(np.float64(self.pt), 1.0)
 
     def orb(self):
         """Get ORB descriptors from all observations."""
@@ -38,51 +76,607 @@ class Point:
 
     def orb_distance(self, des):
         """Compute minimum Hamming distance to descriptor."""
-        return min([hamming_distance(o, des) for o in self.orb()])
+        return int(self.orb_distances(des)[0])
+
+    def orb_distances(self, des):
+        """Minimum Hamming distances of all observations to each descriptor."""
+        return hamming_matrix(self.orb(), des).min(axis=0)
 
     def delete(self):
         """Remove this point from all frames."""
-        for f, idx in zip(self.frames, self.idxs):
-            f.pts[idx] = None
-        del self
+        self.mapp.remove_observations(self.mapp.observation_rows(self.id))
 
     def add_observation(self, frame, idx):
         """Add an observation of this point in a frame."""
-        assert frame.pts[idx] is None
-        assert frame not in self.frames
-        frame.pts[idx] = self
-        self.frames.append(frame)
-        self.idxs.append(idx)
+        assert frame.point_ids[idx] == -1
+        assert self.id not in frame.point_ids
+        self.mapp.add_observations(frame, [idx], [self.id])
+
+    def remove_observation(self, frame):
+        """Remove the observation of this point in a frame."""
+        rows = self.mapp.observation_rows(self.id)
+        self.mapp.remove_observations(rows[self.mapp.obs_frame[rows] == frame.id])
+
+
+class PointViews(dict):
+    """
+    Point views by id, created on first access and cached. A point is in the
+    map while its alive flag is set, so maps loaded or paged in with many
+    points only build the views that are used.
+    """
+
+    def __init__(self, mapp):
+        super().__init__()
+        self.mapp = mapp
+
+    def __missing__(self, i):
+        if i not in self:
+            raise KeyError(i)
+        point = self[i] = Point(self.mapp, None, None, i)
+        return point
+
+    def __contains__(self, i):
+        return 0 <= i < self.mapp.n_points and bool(self.mapp.alive[i])
+
+    def __delitem__(self, i):
+        self.pop(i, None)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.mapp.alive[: self.mapp.n_points]))
+
+    def __iter__(self):
+        return iter(self.mapp.alive_ids().tolist())
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[i] for i in self]
+
+    def items(self):
+        return [(i, self[i]) for i in self]
+
+
+def _observation_pairs(owner):
+    """Positions i < j of all the pairs of equal values in the sorted owner"""
+    _, first, inv, size = np.unique(
+        owner, return_index=True, return_inverse=True, return_counts=True
+    )
+    n_after = (first + size)[inv] - np.arange(len(owner)) - 1
+    a = np.repeat(np.arange(len(owner)), n_after)
+    b = a + 1 + np.arange(len(a)) - np.repeat(np.cumsum(n_after) - n_after, n_after)
+    return a, b
+
+
+def _grow(column, size):
+    """Column with room for size rows, capacity doubles"""
+    if size <= len(column):
+        return column
+    ret = np.zeros((max(size, 2 * len(column)),) + column.shape[1:], column.dtype)
+    ret[: len(column)] = column
+    return ret
 
 
 class Map:
     """
     Global map containing frames, 3D points, and bridge constraints.
+
+    Points are stored as columns: float32 positions, uint8 colors and an
+    alive flag indexed by the point id, ids of removed points are reused.
+    Observations are rows (point id, frame id, keypoint index), indexed by
+    point in CSR form so the observations of a point are one slice.
     """
-    
+
     def __init__(self):
         self.frames = []
-        self.points = []
+        self.frames_by_id = {}  # Frame.id -> Frame
+        self.points_by_id = PointViews(self)  # Frame.point_ids -> Point
         self.max_frame = 0
-        self.max_point = 0
         self.bridge_edges = []  # Store bridge constraints from marginalization
         self.frames_to_remove_after_opt = []  # Frames marked for removal after next optimization
         self.slid_win_size = 10
-
-    def add_point(self, point):
+        self.keyframe_policy = None  # None: every frame is a keyframe
+        self.active_window = 20  # frames keep rebuildable data (KD-tree, kps)
+        self.keyframe_db = None  # KeyframeDatabase for relocalization
+        self.atlas = None  # Atlas spilling far submaps to disk
+        self.optimizer = None  # IncrementalOptimizer kept across g2optimize calls
+        self.local_mapping = None  # LocalMapping running bundle adjustment in the background
+        self.point_hash = None  # PointHash of fuse_points, kept across calls
+
+        # point columns
+        self.positions = np.zeros((0, 3), dtype=np.float32)
+        self.colors = np.zeros((0, 3), dtype=np.uint8)
+        self.alive = np.zeros(0, dtype=bool)
+        self.n_points = 0  # ids in use are below
+        self.free_ids = []
+
+        # observation rows
+        self.obs_point = np.zeros(0, dtype=np.int32)
+        self.obs_frame = np.zeros(0, dtype=np.int32)
+        self.obs_idx = np.zeros(0, dtype=np.int32)
+        self.obs_alive = np.zeros(0, dtype=bool)
+        self.n_obs = 0
+        self._csr = None  # (indptr by point id, observation rows, rows indexed)
+        # covisibility graph: frame id -> {frame id: number of shared points}
+        self.covisibility = defaultdict(Counter)
+        # changes for the IncrementalOptimizer since its last sync: rows from
+        # synced_obs on, keys of removed observations, added, moved or removed points
+        self.synced_obs = 0
+        self.removed_keys = []
+        self.touched_points = []
+        self.culling_time = 0.0
+
+    @property
+    def points(self):
+        return list(self.points_by_id.values())
+
+    def alive_ids(self):
+        """Ids of all the points in the map"""
+        return np.flatnonzero(self.alive[: self.n_points])
+
+    def _new_ids(self, n):
+        reused = [self.free_ids.pop() for _ in range(min(n, len(self.free_ids)))]
+        ids = np.concatenate(
+            [np.array(reused, dtype=int), np.arange(self.n_points, self.n_points + n - len(reused))]
+        )
+        self.n_points += n - len(reused)
+        self.positions = _grow(self.positions, self.n_points)
+        self.colors = _grow(self.colors, self.n_points)
+        self.alive = _grow(self.alive, self.n_points)
+        self.alive[ids] = True
+        self.touch_points(ids)
+        return ids
+
+    def touch_points(self, ids):
+        """The points ids were added, moved or removed, recorded for the incremental optimizer"""
+        if self.optimizer is not None:
+            self.touched_points.append(np.asarray(ids, dtype=int).ravel())
+
+    def add_point(self, point, loc, color):
         """Add a new point to the map."""
-        ret = self.max_point
-        self.max_point += 1
-        self.points.append(point)
+        ret = int(self._new_ids(1)[0])
+        self.positions[ret] = loc
+        self.colors[ret] = color
+        self.points_by_id[ret] = point
+        return ret
+
+    def add_points(self, locs, colors, observations):
+        """
+        Add new points in bulk. Observations are (frame, keypoint indices)
+        pairs with one keypoint per point. Returns the new points.
+        """
+        ids = self._new_ids(len(locs))
+        self.positions[ids] = locs
+        self.colors[ids] = colors
+        points = [Point(self, None, None, i) for i in ids.tolist()]
+        self.points_by_id.update(zip(ids.tolist(), points))
+        for frame, idxs in observations:
+            assert np.all(frame.point_ids[idxs] == -1)
+            self.add_observations(frame, idxs, ids)
+        return points
+
+    def add_observations(self, frame, idxs, ids):
+        """Keypoints idxs of the frame observe the points ids"""
+        # the frame shares these points with the frames already observing them
+        rows, _ = self.observation_rows_of(ids)
+        fids, counts = np.unique(self.obs_frame[rows], return_counts=True)
+        for fid, count in zip(fids.tolist(), counts.tolist()):
+            self.covisibility[frame.id][fid] += count
+            self.covisibility[fid][frame.id] += count
+
+        n = len(idxs)
+        rows = slice(self.n_obs, self.n_obs + n)
+        self.n_obs += n
+        self.obs_point = _grow(self.obs_point, self.n_obs)
+        self.obs_frame = _grow(self.obs_frame, self.n_obs)
+        self.obs_idx = _grow(self.obs_idx, self.n_obs)
+        self.obs_alive = _grow(self.obs_alive, self.n_obs)
+        self.obs_point[rows] = ids
+        self.obs_frame[rows] = frame.id
+        self.obs_idx[rows] = idxs
+        self.obs_alive[rows] = True
+        frame.point_ids[idxs] = ids
+
+    def remove_observations(self, rows):
+        """Drop observation rows and free the keypoints in their frames"""
+        rows = rows[self.obs_alive[rows]]
+        self._uncount_covisibility(rows)
+        self.obs_alive[rows] = False
+        if self.optimizer is not None:
+            self.removed_keys.append(observation_keys(self.obs_frame[rows], self.obs_idx[rows]))
+        for fid in np.unique(self.obs_frame[rows]).tolist():
+            frame = self.frames_by_id.get(fid)
+            if frame is not None:
+                frame.point_ids[self.obs_idx[rows[self.obs_frame[rows] == fid]]] = -1
+
+    def observations(self):
+        """
+        Observation rows of all the points in CSR form: the rows of point i
+        are rows[indptr[i]:indptr[i + 1]] in observation order.
+        Removed rows are still listed until the next rebuild.
+        """
+        if self._csr is None or self._csr[2] < self.n_obs:
+            self._build_csr()
+        return self._csr[:2]
+
+    def _build_csr(self):
+        if self.n_obs > 2 * np.count_nonzero(self.obs_alive[: self.n_obs]):
+            self._compact_observations()
+        obs_point = self.obs_point[: self.n_obs]
+        rows = np.argsort(obs_point, kind="stable")
+        indptr = np.zeros(self.n_points + 1, dtype=np.int64)
+        np.cumsum(np.bincount(obs_point, minlength=self.n_points), out=indptr[1:])
+        self._csr = indptr, rows, self.n_obs
+
+    def _compact_observations(self):
+        keep = np.flatnonzero(self.obs_alive[: self.n_obs])
+        self.synced_obs = int(np.count_nonzero(self.obs_alive[: self.synced_obs]))
+        for name in ("obs_point", "obs_frame", "obs_idx", "obs_alive"):
+            column = getattr(self, name)
+            column[: len(keep)] = column[keep]
+        self.n_obs = len(keep)
+
+    def observation_rows(self, pid):
+        """Alive observation rows of one point"""
+        return self.observation_rows_of([pid])[0]
+
+    def observation_rows_of(self, ids):
+        """
+        Alive observation rows of many points, grouped by point in
+        observation order, and the position in ids of the point of every row.
+        Rows added since the last CSR build are searched in the short tail,
+        the index is rebuilt when the tail grows past a quarter of it.
+        """
+        ids = np.asarray(ids, dtype=int)
+        if self._csr is None or self.n_obs - self._csr[2] > max(1024, self._csr[2] // 4):
+            self._build_csr()
+        indptr, rows, n_built = self._csr
+        indexed = np.minimum(ids, len(indptr) - 2)
+        starts = indptr[indexed]
+        lens = np.where(ids < len(indptr) - 1, indptr[indexed + 1] - starts, 0)
+        owner = np.repeat(np.arange(len(ids)), lens)
+        sel = rows[np.repeat(starts - (np.cumsum(lens) - lens), lens) + np.arange(lens.sum())]
+        if n_built < self.n_obs:
+            position = np.full(self.n_points, -1)
+            position[ids] = np.arange(len(ids))
+            tail = np.arange(n_built, self.n_obs)
+            tail_owner = position[self.obs_point[tail]]
+            found = tail_owner >= 0
+            order = np.argsort(np.concatenate([owner, tail_owner[found]]), kind="stable")
+            sel = np.concatenate([sel, tail[found]])[order]
+            owner = np.concatenate([owner, tail_owner[found]])[order]
+        live = self.obs_alive[sel]
+        return sel[live], owner[live]
+
+    def observations_of(self, pid):
+        """Frame ids and keypoint indices of the observations of one point"""
+        rows = self.observation_rows(pid)
+        return self.obs_frame[rows], self.obs_idx[rows]
+
+    def _uncount_covisibility(self, rows):
+        """Drop the shared points of the observation rows about to be removed"""
+        removed = np.zeros(self.n_obs, dtype=bool)
+        removed[rows] = True
+        pts, owner = self.observation_rows_of(np.unique(self.obs_point[rows]))
+        # all the pairs of observations of a point, at least one removed
+        a, b = (pts[k] for k in _observation_pairs(owner))
+        hit = removed[a] | removed[b]
+        pairs = np.sort(np.stack([self.obs_frame[a[hit]], self.obs_frame[b[hit]]], axis=1), axis=1)
+        pairs, counts = np.unique(pairs, axis=0, return_counts=True)
+        for (f1, f2), count in zip(pairs.tolist(), counts.tolist()):
+            for fa, fb in ((f1, f2), (f2, f1)):
+                self.covisibility[fa][fb] -= count
+                if self.covisibility[fa][fb] <= 0:
+                    del self.covisibility[fa][fb]
+
+    def covisible_frames(self, frame, n):
+        """The n keyframes sharing most points with the frame"""
+        return [
+            self.frames_by_id[fid]
+            for fid, _ in self.covisibility[frame.id].most_common()
+            if fid in self.frames_by_id
+        ][:n]
+
+    def points_of(self, frames):
+        """Points observed in the frames, from their point ids"""
+        ids = np.unique(np.concatenate([f.point_ids for f in frames]))
+        return [self.points_by_id[i] for i in ids[ids >= 0].tolist()]
+
+    def fuse_points(self, radius, max_distance=64, ids=None):
+        """
+        Merge points closer than radius with compatible descriptors (the
+        latest observations within max_distance) that are never observed
+        in the same frame. Neighbours of the points ids (default all) are
+        found with the PointHash of the map, updated with the points added,
+        moved or removed since the last call. The point with more observations
+        keeps its id and gets the observations of the other one, at the
+        observation weighted mean position. Returns the number of merges.
+        """
+        alive = self.alive[: self.n_points]
+        if np.count_nonzero(alive) < 2:
+            return 0
+        ids = self.alive_ids() if ids is None else np.asarray(ids, dtype=int)
+        if self.point_hash is None or self.point_hash.voxel_size != radius:
+            self.point_hash = PointHash(radius)
+        self.point_hash.update(self.positions[: self.n_points], alive)
+        q, b = self.point_hash.query(self.positions[ids], radius)
+        a = ids[q]
+        a, b = a[a != b], b[a != b]
+        a, b = np.unique(np.sort(np.stack([a, b], axis=1), axis=1), axis=0).T
+        if not len(a):
+            return 0
+
+        # latest observation of the candidate points as their descriptor
+        pids, inv = np.unique(np.concatenate([a, b]), return_inverse=True)
+        rows, owner = self.observation_rows_of(pids)
+        last = np.flatnonzero(np.append(owner[1:] != owner[:-1], True))
+        latest = np.empty(len(pids), dtype=int)
+        latest[owner[last]] = rows[last]
+        des = self.observation_descriptors(latest[inv])
+        close = hamming_pairs(des[: len(a)], des[len(a) :]) < max_distance
+        a, b = a[close], b[close]
+
+        # closest pairs first, every point merged at most once per pass
+        order = np.argsort(np.linalg.norm(self.positions[a] - self.positions[b], axis=1))
+        used, merged = set(), 0
+        for i, j in zip(a[order].tolist(), b[order].tolist()):
+            if i in used or j in used or not self.merge_points(i, j):
+                continue
+            used.update((i, j))
+            merged += 1
+        return merged
+
+    def merge_points(self, i, j):
+        """
+        Merge two points that are never observed in the same frame. The
+        point with more observations keeps its id and gets the observations
+        of the other one, at the observation weighted mean position.
+        Returns False when the points share a frame.
+        """
+        rows_i, rows_j = self.observation_rows(i), self.observation_rows(j)
+        if np.intersect1d(self.obs_frame[rows_i], self.obs_frame[rows_j]).size:
+            return False
+        if len(rows_i) < len(rows_j):
+            i, j, rows_i, rows_j = j, i, rows_j, rows_i
+        n_i, n_j = len(rows_i), len(rows_j)
+        self.positions[i] = (n_i * self.positions[i] + n_j * self.positions[j]) / (n_i + n_j)
+        self.touch_points([i])
+        moved = list(zip(self.obs_frame[rows_j].tolist(), self.obs_idx[rows_j].tolist()))
+        self.remove_points([j])
+        for fid, k in moved:
+            self.add_observations(self.frames_by_id[fid], [k], [i])
+        return True
+
+    def close_loop(
+        self, frame, loop_frame, pose, idx1, idx2, rounds=20, solverSE3="EigenSE3", min_shared=100
+    ):
+        """
+        Correct the drift accumulated between loop_frame and frame, pose is
+        the pose of frame verified against the map points of loop_frame with
+        the matches idx1 (frame) - idx2 (loop_frame). The keyframe poses are
+        optimized on a pose graph of consecutive keyframes, covisible ones
+        sharing at least min_shared points and the loop, loop_frame stays
+        fixed. The frame and its covisible keyframes start from the corrected
+        pose and are tied to loop_frame, the graph spreads the correction
+        back along the trajectory. Points move with their anchor keyframe
+        (first observation) and the matched points of both ends are fused.
+        Spilled submaps between both ends are paged in first, their keyframes
+        and points take the correction with the others.
+        Returns the final chi2 error and the number of fused points.
+        """
+        if self.atlas is not None:
+            self.atlas.page_in_between(self, loop_frame.id, frame.id)
+        old_poses = {f.id: f.pose for f in self.frames}
+        info = np.eye(6)
+        pairs = {(a.id, b.id) for a, b in zip(self.frames[:-1], self.frames[1:])}
+        pairs.update(
+            (a, b)
+            for a, neighbours in self.covisibility.items()
+            for b, shared in neighbours.items()
+            if a < b and shared >= min_shared and a in self.frames_by_id and b in self.frames_by_id
+        )
+        edges = [
+            (a, b, self.frames_by_id[a].pose_inv @ self.frames_by_id[b].pose, info)
+            for a, b in sorted(pairs)
+        ]
+
+        # the frame and its neighbours away from the loop take the correction
+        # first and are tied to loop_frame, the graph spreads the rest
+        correction = frame.pose_inv @ pose
+        loop_side = set(self.covisibility[loop_frame.id]) | {loop_frame.id}
+        current = [frame] + [
+            self.frames_by_id[fid]
+            for fid in self.covisibility[frame.id]
+            if fid not in loop_side and fid in self.frames_by_id
+        ]
+        for f in current:
+            f.pose = f.pose @ correction
+            edges.append((loop_frame.id, f.id, loop_frame.pose_inv @ f.pose, info))
+        err = optimize_pose_graph(self.frames, edges, {loop_frame.id}, rounds, solverSE3)
+
+        # every point moves rigidly with its anchor keyframe
+        ids = self.alive_ids()
+        rows, owner = self.observation_rows_of(ids)
+        first = np.flatnonzero(np.append(True, owner[1:] != owner[:-1]))
+        ids = ids[owner[first]]
+        fids, anchor = np.unique(self.obs_frame[rows[first]], return_inverse=True)
+        moves = np.array(
+            [self.frames_by_id[fid].pose_inv @ old_poses[fid] for fid in fids.tolist()]
+        ).reshape(-1, 4, 4)
+        X = np.float64(self.positions[ids])
+        self.positions[ids] = (
+            np.einsum("nij,nj->ni", moves[anchor, :3, :3], X) + moves[anchor, :3, 3]
+        )
+        self.touch_points(ids)
+
+        # fuse the points seen from both ends of the loop
+        p1, p2 = frame.point_ids[idx1], loop_frame.point_ids[idx2]
+        new = (p1 < 0) & (p2 >= 0) & ~np.isin(p2, frame.point_ids)
+        _, unique = np.unique(p2[new], return_index=True)
+        self.add_observations(frame, idx1[new][unique], p2[new][unique])
+        used, fused = set(), 0
+        for i, j in zip(p1.tolist(), p2.tolist()):
+            if i < 0 or j < 0 or i == j or i in used or j in used:
+                continue
+            if self.merge_points(i, j):
+                used.update((i, j))
+                fused += 1
+        return err, fused
+
+    def observation_descriptors(self, rows):
+        """Descriptors of the keypoints of observation rows, one gather per frame"""
+        fids = self.obs_frame[rows]
+        ret = None
+        for fid in np.unique(fids).tolist():
+            sel = fids == fid
+            des = self.frames_by_id[fid].descriptors[self.obs_idx[rows[sel]]]
+            if ret is None:
+                ret = np.empty((len(rows),) + des.shape[1:], des.dtype)
+            ret[sel] = des
         return ret
 
+    def remove_point(self, point):
+        """Remove a point from the map and from the frames observing it."""
+        self.remove_points([point.id])
+
+    def remove_points(self, ids):
+        """Remove points in bulk, their ids are free for reuse."""
+        ids = np.asarray(ids, dtype=int)
+        if not len(ids):
+            return
+        rows, _ = self.observation_rows_of(ids)
+        self.remove_observations(rows)
+        self.alive[ids] = False
+        self.touch_points(ids)
+        for i in ids.tolist():
+            del self.points_by_id[i]
+        self.free_ids.extend(ids.tolist())
+        if self.atlas is not None:
+            self.atlas.forget(ids)
+
     def add_frame(self, frame):
         """Add a new frame to the map."""
+        if self.atlas is not None:
+            self.atlas.update(self)
         ret = self.max_frame
         self.max_frame += 1
         self.frames.append(frame)
+        self.frames_by_id[ret] = frame
+        if self.keyframe_db is not None:
+            self.keyframe_db.add(ret, frame.descriptors)
+        if len(self.frames) > self.active_window:
+            self.frames[-self.active_window - 1].release()
         return ret
 
+    def local_map(self, n_keyframes, frame):
+        """
+        Map points observed in the last n keyframes before the frame and not
+        yet observed by it, with one descriptor (the latest observation)
+        and the position of every point as contiguous arrays.
+        """
+        keyframes = [f for f in self.frames[-n_keyframes - 1 :] if f is not frame]
+        ids = np.unique(np.concatenate([f.point_ids for f in keyframes[-n_keyframes:]]))
+        ids = np.setdiff1d(ids[ids >= 0], frame.point_ids)
+        points = [self.points_by_id[i] for i in ids.tolist()]
+        if not points:
+            return points, None, np.empty((0, 3))
+        # latest observation of every point, the last of its rows
+        rows, owner = self.observation_rows_of(ids)
+        last = np.flatnonzero(np.append(owner[1:] != owner[:-1], True))
+        descriptors = self.observation_descriptors(rows[last])
+        return points, descriptors, np.float64(self.positions[ids])
+
+    def save(self, path):
+        """
+        Save keyframes (poses, intrinsics, keypoints, descriptors), point
+        columns, observations and the covisibility graph as plain arrays
+        in an uncompressed .npz archive. Submaps spilled by the atlas are
+        read from their files and written too, without paging them in.
+        """
+        rows = np.flatnonzero(self.obs_alive[: self.n_obs])
+        frames = pack_frames(self.frames)
+        alive = self.alive[: self.n_points]
+        obs = self.obs_point[rows], self.obs_frame[rows], self.obs_idx[rows]
+        covisibility = self.covisibility
+        if self.atlas is not None and self.atlas.centers:
+            packs, spilled = self.atlas.spilled_arrays(self)
+            frames = concat_packed([frames] + packs)
+            # the dormant points observed by the spilled submaps are alive in the file
+            alive = alive.copy()
+            alive[spilled[0]] = True
+            covisibility = self._spilled_covisibility(obs, spilled)
+            obs = tuple(np.concatenate(pair) for pair in zip(obs, spilled))
+        edges = [(a, b, w) for a, c in covisibility.items() for b, w in c.items()]
+        np.savez(
+            path,
+            version=MAP_FORMAT_VERSION,
+            max_frame=self.max_frame,
+            **frames,
+            positions=self.positions[: self.n_points],
+            colors=self.colors[: self.n_points],
+            alive=alive,
+            obs_point=obs[0],
+            obs_frame=obs[1],
+            obs_idx=obs[2],
+            covisibility=np.array(edges, dtype=np.int64).reshape(-1, 3),
+        )
+
+    def _spilled_covisibility(self, obs, spilled):
+        """The covisibility graph with the points shared by spilled observations"""
+        point = np.concatenate([obs[0], spilled[0]])
+        frame = np.concatenate([obs[1], spilled[1]])
+        order = np.argsort(point, kind="stable")
+        a, b = (order[k] for k in _observation_pairs(point[order]))
+        hit = (a >= len(obs[0])) | (b >= len(obs[0]))
+        pairs = np.sort(np.stack([frame[a[hit]], frame[b[hit]]], axis=1), axis=1)
+        pairs, counts = np.unique(pairs, axis=0, return_counts=True)
+        ret = defaultdict(Counter, {fid: Counter(c) for fid, c in self.covisibility.items()})
+        for (f1, f2), count in zip(pairs.tolist(), counts.tolist()):
+            ret[f1][f2] += count
+            ret[f2][f1] += count
+        return ret
+
+    @classmethod
+    def load(cls, path):
+        """Load a map written by Map.save"""
+        data = np.load(path)
+        if int(data["version"]) != MAP_FORMAT_VERSION:
+            raise ValueError(
+                f"Map format version {int(data['version'])} is not {MAP_FORMAT_VERSION}"
+            )
+        mapp = cls()
+        mapp.max_frame = int(data["max_frame"])
+
+        mapp.frames = unpack_frames(mapp, data)
+        mapp.frames_by_id = {f.id: f for f in mapp.frames}
+        for frame in mapp.frames[: -mapp.active_window]:
+            frame.release()
+
+        # point columns
+        mapp.positions = data["positions"]
+        mapp.colors = data["colors"]
+        mapp.alive = data["alive"]
+        mapp.n_points = len(mapp.alive)
+        mapp.free_ids = np.flatnonzero(~mapp.alive).tolist()
+
+        # observations and the keypoints they assign
+        mapp.obs_point = data["obs_point"]
+        mapp.obs_frame = data["obs_frame"]
+        mapp.obs_idx = data["obs_idx"]
+        mapp.n_obs = len(mapp.obs_point)
+        mapp.obs_alive = np.ones(mapp.n_obs, dtype=bool)
+        order = np.argsort(mapp.obs_frame, kind="stable")
+        fids, starts = np.unique(mapp.obs_frame[order], return_index=True)
+        for fid, rows in zip(fids.tolist(), np.split(order, starts[1:])):
+            mapp.frames_by_id[fid].point_ids[mapp.obs_idx[rows]] = mapp.obs_point[rows]
+        for a, b, w in data["covisibility"].tolist():
+            mapp.covisibility[a][b] = w
+        return mapp
+
+    def reference_frame(self, frame):
+        """Last keyframe preceding the frame"""
+        return self.frames[-1] if frame.id is None else self.frames[-2]
+
     def g2optimize(
         self,
         local_window=20,
@@ -92,6 +686,9 @@ class Map:
         solverSE3="EigenSE3",
         slid_win=False,
         win_size=10,
+        covisible=0,
+        incremental=False,
+        background=False,
     ):
         """
         Perform bundle adjustment optimization.
@@ -103,9 +700,16 @@ class Map:
             rounds: Optimization iterations
             solverSE3: Linear solver type
             slid_win: Apply sliding window before optimization
+            covisible: Optimize the last keyframe and its covisible
+                keyframes, at most this many, instead of local_window
+            incremental: Update the graph of the last call instead of
+                building a new one
+            background: Optimize in the local mapping process, the result
+                of the last finished optimization is merged first and a
+                new one starts when none is running
             
         Returns:
-            tuple: (error, culled_points_count)
+            tuple: (error, culled_points_count, culling_time)
         """
 
         # Sliding window logic (only if enabled)
@@ -120,51 +724,162 @@ class Map:
             # SECOND: Apply sliding window (marks frames for NEXT optimization)
             self.slide_window()
 
+        if incremental or background:
+            if covisible > 0 and self.frames:
+                local_frames = [self.frames[-1]] + self.covisible_frames(self.frames[-1], covisible)
+            else:
+                local_frames = self.frames if local_window is None else self.frames[-local_window:]
+
+        if background:
+            if self.local_mapping is None:
+                self.local_mapping = LocalMapping()
+            ret = self.merge_local_mapping()
+            if not self.local_mapping.busy:
+                self.local_mapping.submit(
+                    self,
+                    local_frames,
+                    fix_points,
+                    rounds,
+                    solverSE3,
+                    bridge_edges=self.bridge_edges if slid_win else None,
+                )
+            return ret or (self.local_mapping.err, 0, 0.0)
+        elif incremental:
+            if self.optimizer is None or self.optimizer.solverSE3 != solverSE3:
+                # a new graph starts from the whole map
+                self.optimizer = IncrementalOptimizer(solverSE3)
+                self.synced_obs, self.removed_keys = 0, []
+                self.touched_points = [self.alive_ids()]
+            err = self.optimizer.optimize(
+                self,
+                local_frames,
+                fix_points,
+                verbose,
+                rounds,
+                bridge_edges=self.bridge_edges if slid_win else None,
+            )
+        else:
+            self.optimizer, self.removed_keys, self.touched_points = None, [], []
+            err = self._optimize(
+                local_window, fix_points, verbose, rounds, solverSE3, slid_win, covisible
+            )
+
+        # FOURTH: Prune low-quality points
+        start_time = time.perf_counter()
+        culled = self.cull_points()
+        self.culling_time = time.perf_counter() - start_time
+
+        return err, len(culled), self.culling_time
+
+    def merge_local_mapping(self, wait=False):
+        """
+        Merge the finished background optimization at a frame boundary and
+        prune points. Returns (error, culled_points_count, culling_time) or
+        None when it is still running.
+        """
+        if self.local_mapping is None:
+            return None
+        err = self.local_mapping.merge(self, wait)
+        if err is None:
+            return None
+        start_time = time.perf_counter()
+        culled = self.cull_points()
+        self.culling_time = time.perf_counter() - start_time
+        return err, len(culled), self.culling_time
+
+    def close_local_mapping(self):
+        """Stop the background optimization and its worker process"""
+        if self.local_mapping is not None:
+            self.local_mapping.close()
+            self.local_mapping = None
+
+    def _optimize(self, local_window, fix_points, verbose, rounds, solverSE3, slid_win, covisible):
+        """Bundle adjustment on a graph built for this call"""
+        # Local window from the covisibility graph
+        local_frames, frames = None, self.frames
+        if covisible > 0 and self.frames:
+            local_frames = [self.frames[-1]] + self.covisible_frames(self.frames[-1], covisible)
+            ids = np.unique(np.concatenate([f.point_ids for f in local_frames]))
+            # fixed frames are only the ones observing the points of the local frames
+            rows, _ = self.observation_rows_of(ids[ids >= 0])
+            fids = set(np.unique(self.obs_frame[rows]).tolist())
+            frames = [f for f in self.frames if f.id in fids]
+
+        if slid_win:
             # THIRD: Run optimization with current frames and bridges
             err = optimize(
-                self.frames,
-                self.points,
+                frames,
+                self,
                 local_window,
                 fix_points,
                 verbose,
                 rounds,
                 solverSE3,
                 bridge_edges=self.bridge_edges,
+                local_frames=local_frames,
             )
         else:
             # No sliding window - standard optimization without bridges
             err = optimize(
-                self.frames,
-                self.points,
+                frames,
+                self,
                 local_window,
                 fix_points,
                 verbose,
                 rounds,
                 solverSE3,
                 bridge_edges=None,  # No bridge constraints
+                local_frames=local_frames,
             )
+        return err
 
-        # FOURTH: Prune low-quality points
-        culled_pt_count = 0
-        for p in self.points[:]:
-            # Old points with few observations
-            old_point = len(p.frames) <= 4 and p.frames[-1].id + 7 < self.max_frame
-
-            # Compute reprojection errors
-            errs = []
-            for f, idx in zip(p.frames, p.idxs):
-                uv = f.kps[idx]
-                proj = f.pose[:3] @ p.homogeneous()
-                proj = proj[0:2] / proj[2]
-                errs.append(np.linalg.norm(proj - uv))
-
-            # Cull bad points
-            if old_point or np.mean(errs) > CULLING_ERR_THRES:
-                culled_pt_count += 1
-                self.points.remove(p)
-                p.delete()
-        
-        return err, culled_pt_count
+    def cull_points(self):
+        """
+        Remove points no keyframe observes, old points with few observations
+        and points with a mean reprojection error above CULLING_ERR_THRES,
+        computed over all the observations at once. Returns the ids of the
+        removed points.
+        """
+        indptr, rows = self.observations()
+        rows = rows[self.obs_alive[rows]]  # grouped by point, in observation order
+        frame_pos = np.full(self.max_frame, -1)
+        frame_pos[[f.id for f in self.frames]] = np.arange(len(self.frames))
+        rows = rows[frame_pos[self.obs_frame[rows]] >= 0]
+        if not len(rows):
+            culled = self.alive_ids()
+            self.remove_points(culled)
+            return culled
+        pid = self.obs_point[rows]
+        fpos = frame_pos[self.obs_frame[rows]]
+
+        # keypoints of the observations, only the observed ones are normalized
+        order = np.argsort(fpos, kind="stable")
+        uv = np.empty((len(rows), 2))
+        for sel in np.split(order, np.flatnonzero(np.diff(fpos[order])) + 1):
+            f = self.frames[fpos[sel[0]]]
+            uv[sel] = normalize(f.Kinv, f.key_pts[self.obs_idx[rows[sel]]])
+
+        # reprojection errors with the stacked poses
+        poses = np.array([f.pose for f in self.frames])[fpos]
+        proj = np.einsum("nij,nj->ni", poses[:, :3, :3], np.float64(self.positions[pid]))
+        proj += poses[:, :3, 3]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            errs = np.linalg.norm(proj[:, 0:2] / proj[:, 2:] - uv, axis=1)
+        n_obs = np.bincount(pid, minlength=self.n_points)
+        mean_err = np.bincount(pid, errs, minlength=self.n_points) / np.maximum(n_obs, 1)
+
+        # Old points with few observations
+        last = np.flatnonzero(np.append(pid[1:] != pid[:-1], True))
+        last_frame = np.zeros(self.n_points, dtype=int)
+        last_frame[pid[last]] = self.obs_frame[rows[last]]
+        old_point = (n_obs <= 4) & (last_frame + 7 < self.max_frame)
+
+        # Cull bad points
+        bad = (n_obs == 0) | old_point | ~(mean_err <= CULLING_ERR_THRES)
+        bad &= self.alive[: self.n_points]
+        culled = np.flatnonzero(bad)
+        self.remove_points(culled)
+        return culled
 
     def slide_window(self):
         """
@@ -191,7 +906,7 @@ class Map:
         # Create bridge constraint between last old and first new
         T_old = last_old.pose
         T_new = first_new.pose
-        rel_T = np.linalg.inv(T_old) @ T_new
+        rel_T = last_old.pose_inv @ T_new
 
         # Important: Store bridge with CURRENT frame IDs before removal
         # After old frames are removed, this bridge becomes a "fixed constraint"
@@ -224,35 +939,31 @@ class Map:
         """
         Remove old frames and their orphaned points.
         """
-        frames_to_keep = [f for f in self.frames if f not in frames_to_remove]
+        frames_to_remove = [f for f in frames_to_remove if f.id in self.frames_by_id]
         removed_frame_ids = {f.id for f in frames_to_remove}
-        
+
+        # points observed in the old frames, from their point ids
+        touched = [f.point_ids[f.point_ids >= 0] for f in frames_to_remove]
+        touched = np.unique(np.concatenate(touched)) if touched else np.empty(0, dtype=int)
+        rows, owner = self.observation_rows_of(touched)
+        old = np.isin(self.obs_frame[rows], list(removed_frame_ids))
+
         # Remove points that are ONLY observed in old frames
-        points_removed = 0
-        for point in self.points[:]:
-            has_new_observations = any(f in frames_to_keep for f in point.frames)
-            
-            if not has_new_observations:
-                self.points.remove(point)
-                point.delete()
-                points_removed += 1
-            else:
-                # Remove observations from old frames
-                for i in range(len(point.frames) - 1, -1, -1):
-                    if point.frames[i] in frames_to_remove:
-                        frame = point.frames[i]
-                        idx = point.idxs[i]
-                        if idx < len(frame.pts) and frame.pts[idx] is point:
-                            frame.pts[idx] = None
-                        point.frames.pop(i)
-                        point.idxs.pop(i)
-
-        print(f"[Cleanup] Removed {points_removed} orphaned points")
+        n_new = np.bincount(owner[~old], minlength=len(touched))
+        orphans = touched[n_new == 0]
+        self.remove_points(orphans)
+        print(f"[Cleanup] Removed {len(orphans)} orphaned points")
+
+        # Remove observations from old frames
+        self.remove_observations(rows[old])
 
         # Remove old frames
-        for frame in frames_to_remove:
-            if frame in self.frames:
-                self.frames.remove(frame)
+        self.frames = [f for f in self.frames if f.id not in removed_frame_ids]
+        for fid in removed_frame_ids:
+            del self.frames_by_id[fid]
+            self.covisibility.pop(fid, None)
+            if self.keyframe_db is not None:
+                self.keyframe_db.remove(fid)
         
         print(f"[Cleanup] Removed {len(frames_to_remove)} frames: {sorted(removed_frame_ids)}")
         
@@ -8,13 +8,11 @@ by the camera matrices.
 """
 
 import numpy as np
+import cv2
 
 
-def triangulate(pose1, pose2, pts1, pts2):
-    """Taking into account relative poses,
-    we calculate the 3d point.
-    linalg.svd - Singular Value Decomposition.
-    """
+def triangulate_loop(pose1, pose2, pts1, pts2):
+    """Reference implementation, one SVD per point"""
     ret = np.zeros((pts1.shape[0], 4))
     for i, p in enumerate(zip(pts1, pts2)):
         A = np.zeros((4, 4))
@@ -25,3 +23,44 @@ def triangulate(pose1, pose2, pts1, pts2):
         _, _, vt = np.linalg.svd(A)
         ret[i] = vt[3]
     return ret
+
+
+def triangulate_svd(pose1, pose2, pts1, pts2):
+    """All the 4x4 systems as one (N,4,4) array and a single stacked SVD"""
+    A = np.empty((pts1.shape[0], 4, 4))
+    A[:, 0] = pts1[:, 0:1] * pose1[2] - pose1[0]
+    A[:, 1] = pts1[:, 1:2] * pose1[2] - pose1[1]
+    A[:, 2] = pts2[:, 0:1] * pose2[2] - pose2[0]
+    A[:, 3] = pts2[:, 1:2] * pose2[2] - pose2[1]
+    _, _, vt = np.linalg.svd(A)
+    return vt[:, 3]
+
+
+def triangulate_opencv(pose1, pose2, pts1, pts2):
+    """cv2.triangulatePoints on the normalized points"""
+    ret = cv2.triangulatePoints(
+        np.float64(pose1[:3]),
+        np.float64(pose2[:3]),
+        np.float64(pts1).T,
+        np.float64(pts2).T,
+    )
+    return ret.T
+
+
+BACKENDS = {
+    "SVD": triangulate_svd,
+    "OpenCV": triangulate_opencv,
+    "Loop": triangulate_loop,
+}
+
+
+def triangulate(pose1, pose2, pts1, pts2, backend="SVD"):
+    """Taking into account relative poses,
+    we calculate the 3d point.
+    linalg.svd - Singular Value Decomposition.
+    Returns homogeneous points, the backends may differ in the sign
+    and scale of the homogeneous coordinate.
+    """
+    if not len(pts1):
+        return np.zeros((0, 4))
+    return BACKENDS[backend](pose1, pose2, pts1, pts2)
@@ -0,0 +1,223 @@
+"""
+Bag of binary words for place recognition.
+A vocabulary tree is trained offline by hierarchical k-majority clustering
+of binary descriptors (ORB, AKAZE), its leaves are the words. Keyframes are
+described by tf-idf weighted word histograms and indexed in an inverted file,
+so a query only scores keyframes sharing words with it.
+
+Training from videos:
+
+    python -m boxes.slam_toolbox.vocabulary vocabulary.npz video1.mp4 video2.mp4
+"""
+
+from collections import defaultdict, deque
+import numpy as np
+import cv2
+
+from boxes.slam_toolbox.hamming import POPCOUNT, hamming_matrix
+from boxes.slam_toolbox.frame import detectFeatures
+
+VOCABULARY_FORMAT_VERSION = 1
+
+
+def kmajority(des, k, rng, iterations=10):
+    """
+    Cluster binary descriptors (N, D) into at most k clusters, k-means++
+    seeding and majority-bit centers. Returns centers (k, D) and labels (N,).
+    """
+    centers = [des[rng.integers(len(des))]]
+    dist = hamming_matrix(des, centers[0])[:, 0].astype(np.float64)
+    for _ in range(1, k):
+        if not dist.any():
+            break
+        centers.append(des[rng.choice(len(des), p=dist**2 / np.sum(dist**2))])
+        dist = np.minimum(dist, hamming_matrix(des, centers[-1])[:, 0])
+    centers = np.array(centers)
+
+    bits = np.unpackbits(des, axis=1)
+    labels = None
+    for _ in range(iterations):
+        new_labels = np.argmin(hamming_matrix(des, centers), axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        used = np.unique(labels)
+        centers = np.array([np.packbits(bits[labels == j].mean(axis=0) >= 0.5) for j in used])
+        labels = np.searchsorted(used, labels)
+    return centers, labels
+
+
+class Vocabulary:
+    """
+    Vocabulary tree with branching factor k and up to levels levels.
+    Nodes are stored as arrays: centers (n_nodes, D), children (n_nodes, k)
+    with -1 for none, and the word of every leaf (-1 for inner nodes).
+    """
+
+    def __init__(self, centers, children, words, idf):
+        self.centers = centers
+        self.children = children
+        self.words = words
+        self.idf = idf
+
+    @property
+    def n_words(self):
+        return len(self.idf)
+
+    @classmethod
+    def train(cls, descriptors, k=10, levels=4, seed=0):
+        """Train on a list of descriptor arrays, one per training image"""
+        rng = np.random.default_rng(seed)
+        data = np.concatenate(descriptors)
+        centers, children, words = [np.zeros(data.shape[1], np.uint8)], [], []
+        queue = deque([(0, np.arange(len(data)), 0)])
+        while queue:
+            node, idx, level = queue.popleft()
+            children.append(np.full(k, -1))
+            if level == levels or len(idx) <= k:
+                words.append(node)
+                continue
+            sub, labels = kmajority(data[idx], k, rng)
+            for j, center in enumerate(sub):
+                children[node][j] = len(centers)
+                queue.append((len(centers), idx[labels == j], level + 1))
+                centers.append(center)
+        word_of_node = np.full(len(centers), -1)
+        word_of_node[words] = np.arange(len(words))
+        vocabulary = cls(np.array(centers), np.array(children), word_of_node, np.ones(len(words)))
+
+        # idf = log(N / images containing the word)
+        n_images = np.zeros(len(words))
+        for des in descriptors:
+            n_images[np.unique(vocabulary.transform(des))] += 1
+        vocabulary.idf = np.log(len(descriptors) / np.maximum(n_images, 1))
+        return vocabulary
+
+    def transform(self, descriptors):
+        """Word of every descriptor, descending the tree level by level"""
+        des = np.asarray(descriptors, dtype=np.uint8)
+        node = np.zeros(len(des), dtype=np.int64)
+        inner = np.flatnonzero(self.children[node, 0] >= 0)
+        while len(inner):
+            cand = self.children[node[inner]]
+            dist = POPCOUNT[np.bitwise_xor(des[inner, None], self.centers[cand])].sum(
+                axis=2, dtype=np.int32
+            )
+            dist[cand < 0] = np.iinfo(np.int32).max
+            node[inner] = cand[np.arange(len(inner)), np.argmin(dist, axis=1)]
+            inner = inner[self.children[node[inner], 0] >= 0]
+        return self.words[node]
+
+    def bow(self, descriptors):
+        """L1 normalized tf-idf vector as sorted word ids and weights"""
+        words, counts = np.unique(self.transform(descriptors), return_counts=True)
+        weights = counts * self.idf[words]
+        total = weights.sum()
+        return words, weights / total if total > 0 else weights
+
+    def save(self, path):
+        np.savez(
+            path,
+            version=VOCABULARY_FORMAT_VERSION,
+            centers=self.centers,
+            children=self.children,
+            words=self.words,
+            idf=self.idf,
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        if int(data["version"]) != VOCABULARY_FORMAT_VERSION:
+            raise ValueError(
+                f"Vocabulary format version {int(data['version'])} "
+                f"is not {VOCABULARY_FORMAT_VERSION}"
+            )
+        return cls(data["centers"], data["children"], data["words"], data["idf"])
+
+
+class KeyframeDatabase:
+    """
+    Inverted file of keyframes: every word maps the ids of the keyframes
+    containing it to their weights. Scores are the L1 similarity of the
+    normalized vectors, 1 - |a - b| / 2 = sum of min(a, b) over shared words.
+    """
+
+    def __init__(self, vocabulary, frames=()):
+        self.vocabulary = vocabulary
+        self.inverted = defaultdict(dict)
+        self.bows = {}
+        for frame in frames:
+            self.add(frame.id, frame.descriptors)
+
+    def __len__(self):
+        return len(self.bows)
+
+    def add(self, fid, descriptors):
+        if descriptors is None or not len(descriptors):
+            return
+        words, weights = self.vocabulary.bow(descriptors)
+        self.bows[fid] = words
+        for word, weight in zip(words.tolist(), weights.tolist()):
+            self.inverted[word][fid] = weight
+
+    def remove(self, fid):
+        for word in self.bows.pop(fid, np.empty(0, dtype=int)).tolist():
+            del self.inverted[word][fid]
+
+    def query(self, descriptors, n=5, exclude=(), min_score=0.0):
+        """Best n keyframes as (id, score) pairs, by decreasing score"""
+        if descriptors is None or not len(descriptors):
+            return []
+        fids, q, w = [], [], []
+        for word, weight in zip(*map(np.ndarray.tolist, self.vocabulary.bow(descriptors))):
+            posting = self.inverted.get(word)
+            if posting:
+                fids.extend(posting)
+                w.extend(posting.values())
+                q.extend([weight] * len(posting))
+        if not fids:
+            return []
+        fids, inv = np.unique(fids, return_inverse=True)
+        scores = np.bincount(inv, np.minimum(q, w))
+        keep = (scores > min_score) & ~np.isin(fids, list(exclude))
+        fids, scores = fids[keep], scores[keep]
+        best = np.argsort(-scores, kind="stable")[:n]
+        return list(zip(fids[best].tolist(), scores[best].tolist()))
+
+
+def training_descriptors(paths, every=10, nfeatures=1000, algorithm="ORB"):
+    """Descriptors of every n-th frame of the videos, one array per frame"""
+    ret = []
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        i = 0
+        while True:
+            ok, image = cap.read()
+            if not ok:
+                break
+            if i % every == 0:
+                _, des = detectFeatures(image, None, nfeatures, algorithm)
+                if des is not None:
+                    ret.append(des)
+            i += 1
+        cap.release()
+    return ret
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train a vocabulary tree on videos")
+    parser.add_argument("output", help="vocabulary file (.npz)")
+    parser.add_argument("videos", nargs="+")
+    parser.add_argument("--every", type=int, default=10, help="use every n-th frame")
+    parser.add_argument("--nfeatures", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10, help="branching factor")
+    parser.add_argument("--levels", type=int, default=4)
+    args = parser.parse_args()
+
+    descriptors = training_descriptors(args.videos, args.every, args.nfeatures)
+    vocabulary = Vocabulary.train(descriptors, args.k, args.levels)
+    vocabulary.save(args.output)
+    print(f"{vocabulary.n_words} words from {len(descriptors)} frames")
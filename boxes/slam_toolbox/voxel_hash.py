@@ -0,0 +1,160 @@
+"""
+Voxel hash of 3D points.
+Points are bucketed into cubic voxels and the occupied voxels are kept
+in an open addressing hash table (linear probing) built and probed with
+array operations, so a voxel lookup is O(1) expected and fixed-radius
+neighbour queries only visit the 27 voxels around a point.
+"""
+
+import numpy as np
+
+EMPTY = np.int64(-1)
+KEY_BITS = 21  # per axis, voxel coordinates within +-2**20
+HASH_MULT = np.uint64(0x9E3779B97F4A7C15)  # Fibonacci hashing
+
+# the 27 voxels around a voxel
+OFFSETS = np.array(
+    [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64
+)
+
+
+def voxel_keys(voxels):
+    """Pack integer voxel coordinates (N, 3) into int64 keys"""
+    v = (voxels + (1 << (KEY_BITS - 1))) & ((1 << KEY_BITS) - 1)
+    return (v[:, 0] << (2 * KEY_BITS)) | (v[:, 1] << KEY_BITS) | v[:, 2]
+
+
+class VoxelHash:
+    """
+    Fixed-radius neighbour queries on points hashed into voxels of
+    voxel_size, queries with a radius up to voxel_size are exact.
+    """
+
+    def __init__(self, positions, voxel_size):
+        self.positions = np.asarray(positions, dtype=np.float64)
+        self.voxel_size = voxel_size
+        voxels = np.floor(self.positions / voxel_size).astype(np.int64)
+
+        # points sorted by voxel, one cell per occupied voxel
+        keys = voxel_keys(voxels)
+        self.order = np.argsort(keys, kind="stable")
+        cell_keys, self.starts, self.counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True
+        )
+
+        # hash table of the cells, twice as large as the number of cells
+        bits = max(1, int(np.ceil(np.log2(2 * len(cell_keys) + 1))))
+        self.shift = np.uint64(64 - bits)
+        self.mask = (1 << bits) - 1
+        self.table_keys = np.full(1 << bits, EMPTY)
+        self.table_cells = np.zeros(1 << bits, dtype=np.int64)
+        pending = np.arange(len(cell_keys))
+        slots = self._hash(cell_keys)
+        while len(pending):
+            s = slots[pending]
+            free = self.table_keys[s] == EMPTY
+            # the first of the cells probing the same free slot takes it
+            taken, first = np.unique(s[free], return_index=True)
+            winners = pending[free][first]
+            self.table_keys[taken] = cell_keys[winners]
+            self.table_cells[taken] = winners
+            pending = np.setdiff1d(pending, winners, assume_unique=True)
+            slots[pending] = (slots[pending] + 1) & self.mask
+
+    def _hash(self, keys):
+        return ((keys.astype(np.uint64) * HASH_MULT) >> self.shift).astype(np.int64)
+
+    def cells(self, keys):
+        """Cell index of every voxel key, -1 for empty voxels"""
+        ret = np.full(len(keys), -1, dtype=np.int64)
+        slots = self._hash(keys)
+        active = np.arange(len(keys))
+        while len(active):
+            found = self.table_keys[slots[active]]
+            hit = found == keys[active]
+            ret[active[hit]] = self.table_cells[slots[active[hit]]]
+            active = active[~hit & (found != EMPTY)]
+            slots[active] = (slots[active] + 1) & self.mask
+        return ret
+
+    def query(self, points, radius):
+        """
+        Neighbours within radius of every query point.
+        Returns query indices and point indices of all the pairs.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        voxels = np.floor(points / self.voxel_size).astype(np.int64)
+        q = np.repeat(np.arange(len(points)), len(OFFSETS))
+        cells = self.cells(voxel_keys((voxels[:, None] + OFFSETS).reshape(-1, 3)))
+        q, cells = q[cells >= 0], cells[cells >= 0]
+
+        # every point of the neighbouring cells
+        counts = self.counts[cells]
+        q = np.repeat(q, counts)
+        first = np.repeat(self.starts[cells] - (np.cumsum(counts) - counts), counts)
+        idx = self.order[first + np.arange(len(q))]
+
+        close = np.sum((self.positions[idx] - points[q]) ** 2, axis=1) <= radius**2
+        return q[close], idx[close]
+
+
+class PointHash:
+    """
+    Voxel hash of the map points kept across queries, indexed by point id.
+    Like the observation index of the Map, points added or moved since the
+    last build are hashed on their own in a short tail, entries of the base
+    that moved or were removed are filtered out of its results, and the
+    base is rebuilt when the tail grows past a quarter of it.
+    """
+
+    def __init__(self, voxel_size):
+        self.voxel_size = voxel_size
+        self.hashed = np.zeros((0, 3), dtype=np.float32)  # position when hashed
+        self.valid = np.zeros(0, dtype=bool)  # alive when hashed
+        self.in_tail = np.zeros(0, dtype=bool)
+        self.base, self.base_ids = None, np.zeros(0, dtype=np.int64)
+        self.tail, self.tail_ids = None, np.zeros(0, dtype=np.int64)
+
+    def update(self, positions, alive):
+        """Hash the points added or moved and drop the removed ones"""
+        n = len(alive)
+        if n > len(self.valid):
+            grow = n - len(self.valid)
+            self.hashed = np.concatenate([self.hashed, np.zeros((grow, 3), np.float32)])
+            self.valid = np.concatenate([self.valid, np.zeros(grow, dtype=bool)])
+            self.in_tail = np.concatenate([self.in_tail, np.zeros(grow, dtype=bool)])
+        same = self.valid[:n] & (self.hashed[:n] == positions[:n]).all(axis=1)
+        changed = np.flatnonzero(alive & ~same)
+        self.valid[:n] = alive
+        if not len(changed):
+            return
+        self.hashed[changed] = positions[changed]
+        self.in_tail[changed] = True
+        self.tail_ids = np.union1d(self.tail_ids, changed)
+        if len(self.tail_ids) > max(1024, len(self.base_ids) // 4):
+            self.base_ids = np.flatnonzero(self.valid)
+            self.base = VoxelHash(self.hashed[self.base_ids], self.voxel_size)
+            self.in_tail[:] = False
+            self.tail, self.tail_ids = None, np.zeros(0, dtype=np.int64)
+        else:
+            self.tail = VoxelHash(self.hashed[self.tail_ids], self.voxel_size)
+
+    def query(self, points, radius):
+        """
+        Neighbours within radius of every query point.
+        Returns query indices and point ids of all the pairs.
+        """
+        qs, ids = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        if self.base is not None:
+            q, idx = self.base.query(points, radius)
+            idx = self.base_ids[idx]
+            keep = self.valid[idx] & ~self.in_tail[idx]
+            qs.append(q[keep])
+            ids.append(idx[keep])
+        if self.tail is not None:
+            q, idx = self.tail.query(points, radius)
+            idx = self.tail_ids[idx]
+            keep = self.valid[idx]
+            qs.append(q[keep])
+            ids.append(idx[keep])
+        return np.concatenate(qs), np.concatenate(ids)
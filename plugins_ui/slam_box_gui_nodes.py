@@ -76,6 +76,53 @@ class DetectorDescriptor(BaseNode):
         self.create_property(
             "algorithm", "ORB", items=descriptors_items, widget_type=NODE_PROP_QCOMBO
         )
+        self.create_property(
+            "label_tiles", "Tiles per side (1 = off)", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("tiles", 1, widget_type=NODE_PROP_INT)
+        self.create_property(
+            "label_workers", "Detection threads", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("workers", 4, widget_type=NODE_PROP_INT)
+        frontend_items = ["Descriptor", "KLT"]
+        self.create_property(
+            "label_frontend", "Front end", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property(
+            "frontend", "Descriptor", items=frontend_items, widget_type=NODE_PROP_QCOMBO
+        )
+        self.create_property(
+            "label_min_tracked", "KLT re-detect below", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("min_tracked", 300, widget_type=NODE_PROP_INT)
+        self.create_property(
+            "label_keyframes", "Keyframe policy", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("keyframes", False, widget_type=NODE_PROP_QCHECKBOX)
+        self.create_property(
+            "label_kf_tracked_ratio", "Min tracked ratio", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("kf_tracked_ratio", 0.7, widget_type=NODE_PROP_FLOAT)
+        self.create_property(
+            "label_kf_parallax", "Min parallax (pix)", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("kf_parallax", 20.0, widget_type=NODE_PROP_FLOAT)
+        self.create_property(
+            "label_kf_interval", "Max keyframe interval", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("kf_interval", 10, widget_type=NODE_PROP_INT)
+        self.create_property(
+            "label_atlas", "Atlas directory (empty = off)", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("atlas", "", widget_type=NODE_PROP_QLINEEDIT)
+        self.create_property(
+            "label_submap_size", "Keyframes per submap", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("submap_size", 50, widget_type=NODE_PROP_INT)
+        self.create_property(
+            "label_atlas_radius", "Submap spill radius", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("atlas_radius", 50.0, widget_type=NODE_PROP_FLOAT)
         self.set_color(*ncs.SLAMBox)
 
 
@@ -101,13 +148,47 @@ class MatchPoints(BaseNode):
             "label_size_marker", "Marker size", widget_type=NODE_PROP_QLABEL
         )
         self.create_property("marker_size", 5, widget_type=NODE_PROP_INT)
-        method_items = ["RANSAC", "USAC_ACCURATE", "USAC_MAGSAC"]
+        method_items = ["RANSAC", "USAC_ACCURATE", "USAC_MAGSAC", "USAC_PROSAC"]
         self.create_property(
             "label_method", "Method", widget_type=NODE_PROP_QLABEL
         )
         self.create_property(
             "method", "USAC_ACCURATE", items=method_items, widget_type=NODE_PROP_QCOMBO
         )
+        self.create_property(
+            "label_guided", "Guided matching", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("guided", False, widget_type=NODE_PROP_QCHECKBOX)
+        self.create_property(
+            "label_guided_radius", "Search radius (pix)", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("guided_radius", 15, widget_type=NODE_PROP_INT)
+        matcher_items = ["BF", "LSH"]
+        self.create_property(
+            "label_matcher", "Matcher", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property(
+            "matcher", "BF", items=matcher_items, widget_type=NODE_PROP_QCOMBO
+        )
+        self.create_property(
+            "label_adaptive", "Adaptive trials", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("adaptive", False, widget_type=NODE_PROP_QCHECKBOX)
+        self.create_property(
+            "label_show_stats", "Show RANSAC stats", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("show_stats", False, widget_type=NODE_PROP_QCHECKBOX)
+        tracking_items = ["Essential", "PnP"]
+        self.create_property(
+            "label_tracking", "Tracking", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property(
+            "tracking", "Essential", items=tracking_items, widget_type=NODE_PROP_QCOMBO
+        )
+        self.create_property(
+            "label_vocabulary", "Relocalization vocabulary", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("vocabulary", "", widget_type=NODE_PROP_FILE)
         self.add_checkbox(
             "show_marker", "Show marker", text="On/Off", state=False, tab="attributes"
         )
@@ -128,6 +209,21 @@ class Triangulate(BaseNode):
         self.create_property(
             "orb_distance", 64.0, range=(1.0, 100.0), widget_type=NODE_PROP_FLOAT
         )
+        self.create_property(
+            "label_local_map", "Local map keyframes (0 = off)", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("local_map", 0, widget_type=NODE_PROP_INT)
+        backend_items = ["SVD", "OpenCV", "Loop"]
+        self.create_property(
+            "label_backend", "Triangulation", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property(
+            "backend", "SVD", items=backend_items, widget_type=NODE_PROP_QCOMBO
+        )
+        self.create_property(
+            "label_fuse_radius", "Fuse radius (0 = off)", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("fuse_radius", 0.0, widget_type=NODE_PROP_FLOAT)
         self.create_property(
             "label_show_marker", "Show marker", widget_type=NODE_PROP_QLABEL
         )
@@ -253,6 +349,26 @@ class GeneralGraphOptimization(BaseNode):
             "label_sliding_window_size", "Sliding window size", widget_type=NODE_PROP_QLABEL
         )
         self.create_property("sliding_window_size", 10, widget_type=NODE_PROP_INT)
+        self.create_property(
+            "label_covisible", "Covisible keyframes (0 = last frames)", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("covisible", 0, widget_type=NODE_PROP_INT)
+        self.create_property(
+            "label_loop_closure", "Loop closure", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("loop_closure", False, widget_type=NODE_PROP_QCHECKBOX)
+        self.create_property(
+            "label_loop_gap", "Loop min keyframe gap", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("loop_gap", 30, widget_type=NODE_PROP_INT)
+        self.create_property(
+            "label_incremental", "Incremental optimizer", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("incremental", False, widget_type=NODE_PROP_QCHECKBOX)
+        self.create_property(
+            "label_background", "Optimize in background", widget_type=NODE_PROP_QLABEL
+        )
+        self.create_property("background", False, widget_type=NODE_PROP_QCHECKBOX)
         
         self.set_color(*ncs.slam_optimization)
 
@@ -0,0 +1,52 @@
+import numpy as np
+
+from boxes.slam_toolbox import Frame, Map
+from boxes.slam_toolbox.atlas import Atlas
+
+W, H = 640, 480
+K = np.array([[500.0, 0, W / 2], [0, 500.0, H / 2], [0, 0, 1]])
+
+
+def drifting_loop(atlas_dir=None):
+    """Six keyframes on a line whose last three drifted, submaps of two keyframes"""
+    rng = np.random.default_rng(0)
+    image = np.empty((H, W, 3), np.uint8)
+    mapp = Map()
+    frames = []
+    for i in range(6):
+        pose = np.eye(4)
+        pose[0, 3] = -0.5 * i + (0.1 * (i - 2) if i > 2 else 0.0)
+        key_pts = rng.uniform((0, 0), (W, H), (40, 2))
+        des = rng.integers(0, 256, (40, 32), dtype=np.uint8)
+        frames.append(Frame(mapp, image, K, pose, features=(key_pts, des)))
+    # consecutive keyframes share points
+    for a, b in zip(frames[:-1], frames[1:]):
+        locs = rng.uniform((-1, -1, 4), (1, 1, 8), (10, 3))
+        mapp.add_points(locs, np.full((10, 3), 128), [(a, np.arange(20, 30)), (b, np.arange(10))])
+    if atlas_dir is not None:
+        mapp.atlas = Atlas(atlas_dir, submap_size=2)
+        mapp.atlas.spill(mapp, 1, frames[2:4])
+    return mapp, frames
+
+
+def test_close_loop_corrects_spilled_submap(tmp_path):
+    """The keyframes and points of a spilled submap in the loop take the correction"""
+    reference, ref_frames = drifting_loop()
+    mapp, frames = drifting_loop(str(tmp_path / "atlas"))
+    spilled_poses = [f.pose for f in frames[2:4]]
+    dormant = np.flatnonzero(mapp.atlas.dormant)
+    assert len(dormant) and not mapp.alive[dormant].any()
+
+    true_pose = np.eye(4)
+    true_pose[0, 3] = -2.5
+    empty = np.empty(0, dtype=int)
+    for m, f in ((reference, ref_frames), (mapp, frames)):
+        m.close_loop(f[5], f[0], true_pose, empty, empty)
+
+    assert not mapp.atlas.centers
+    for fid, old in zip((2, 3), spilled_poses):
+        pose = mapp.frames_by_id[fid].pose
+        assert not np.allclose(pose, old)
+        np.testing.assert_allclose(pose, reference.frames_by_id[fid].pose, atol=1e-6)
+    assert mapp.alive[dormant].all()
+    np.testing.assert_allclose(mapp.positions[dormant], reference.positions[dormant], atol=1e-5)
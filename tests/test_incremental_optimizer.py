@@ -0,0 +1,53 @@
+import numpy as np
+
+from boxes.slam_toolbox import Frame, Map
+from boxes.slam_toolbox.optimize_g2o import IncrementalOptimizer, observation_keys
+
+W, H = 640, 480
+K = np.array([[500.0, 0, W / 2], [0, 500.0, H / 2], [0, 0, 1]])
+
+
+def assert_synced(optimizer, mapp):
+    """The graph holds exactly the alive points and observations of the map"""
+    rows = np.flatnonzero(mapp.obs_alive[: mapp.n_obs])
+    keys = observation_keys(mapp.obs_frame[rows], mapp.obs_idx[rows])
+    assert sorted(optimizer.edges) == sorted(keys.tolist())
+    for key, pid in zip(keys.tolist(), mapp.obs_point[rows].tolist()):
+        assert optimizer.edges[key].vertex(0).id() == 2 * pid + 1
+    ids = mapp.alive_ids()
+    assert sorted(optimizer.points) == ids.tolist()
+    estimates = np.array([optimizer.points[pid].estimate() for pid in ids.tolist()])
+    np.testing.assert_allclose(estimates, mapp.positions[ids], atol=1e-6)
+    assert sorted(optimizer.frames) == sorted(mapp.frames_by_id)
+
+
+def test_sync_applies_recorded_changes():
+    rng = np.random.default_rng(0)
+    image = np.empty((H, W, 3), np.uint8)
+    mapp = Map()
+    frames = []
+    for i in range(3):
+        pose = np.eye(4)
+        pose[0, 3] = -0.2 * i
+        key_pts = rng.uniform((0, 0), (W, H), (60, 2))
+        des = rng.integers(0, 256, (60, 32), dtype=np.uint8)
+        frames.append(Frame(mapp, image, K, pose, features=(key_pts, des)))
+    locs = rng.uniform((-1, -1, 4), (1, 1, 8), (20, 3))
+    mapp.add_points(locs, np.full((20, 3), 128), [(f, np.arange(20)) for f in frames])
+
+    mapp.optimizer = IncrementalOptimizer()
+    mapp.touched_points = [mapp.alive_ids()]
+    mapp.optimizer.sync(mapp)
+    assert_synced(mapp.optimizer, mapp)
+    # nothing changed, nothing recorded
+    assert mapp.synced_obs == mapp.n_obs and not mapp.touched_points
+
+    # added, removed, moved and merged points, reused ids
+    more = rng.uniform((-1, -1, 4), (1, 1, 8), (10, 3))
+    mapp.add_points(more[:5], np.full((5, 3), 128), [(frames[0], np.arange(20, 25))])
+    mapp.remove_points([0, 1, 2])
+    mapp.add_points(more[5:], np.full((5, 3), 128), [(frames[1], np.arange(20, 25))])
+    mapp.points_by_id[10].pt = (0.0, 0.0, 5.0)
+    mapp.merge_points(20, 25)
+    mapp.optimizer.sync(mapp)
+    assert_synced(mapp.optimizer, mapp)
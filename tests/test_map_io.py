@@ -0,0 +1,59 @@
+import numpy as np
+
+from boxes.slam_toolbox import Frame, Map
+from boxes.slam_toolbox.atlas import Atlas
+
+W, H = 640, 480
+K = np.array([[500.0, 0, W / 2], [0, 500.0, H / 2], [0, 0, 1]])
+
+
+def test_save_load_with_spilled_submap(tmp_path):
+    """Map.save writes the spilled submaps and their dormant points from disk"""
+    rng = np.random.default_rng(0)
+    image = np.empty((H, W, 3), np.uint8)
+    mapp = Map()
+    frames = []
+    for i in range(4):
+        pose = np.eye(4)
+        pose[2, 3] = -0.5 * i
+        key_pts = rng.uniform((0, 0), (W, H), (20, 2))
+        des = rng.integers(0, 256, (20, 32), dtype=np.uint8)
+        frames.append(Frame(mapp, image, K, pose, features=(key_pts, des)))
+    locs = rng.uniform((-1, -1, 4), (1, 1, 8), (30, 3))
+    # 0-9 seen only by the first submap, 10-19 by both, 20-29 only by the second
+    mapp.add_points(locs[:10], np.full((10, 3), 64), [(frames[0], np.arange(10))])
+    mapp.add_points(
+        locs[10:20],
+        np.full((10, 3), 128),
+        [(frames[1], np.arange(10)), (frames[2], np.arange(10))],
+    )
+    mapp.add_points(locs[20:], np.full((10, 3), 192), [(frames[3], np.arange(10))])
+    point_ids = {f.id: f.point_ids.copy() for f in frames}
+    ids = mapp.alive_ids()
+
+    mapp.atlas = Atlas(str(tmp_path / "atlas"), submap_size=2)
+    mapp.atlas.spill(mapp, 0, frames[:2])
+    assert len(mapp.frames) == 2 and len(mapp.points) == 20
+
+    mapp.save(tmp_path / "map.npz")
+    # saving leaves the submap on disk
+    assert len(mapp.frames) == 2 and sorted(mapp.atlas.centers) == [0]
+    loaded = Map.load(tmp_path / "map.npz")
+    assert sorted(loaded.frames_by_id) == sorted(point_ids)
+    for fid, expected in point_ids.items():
+        np.testing.assert_array_equal(loaded.frames_by_id[fid].point_ids, expected)
+    np.testing.assert_array_equal(loaded.alive_ids(), ids)
+    np.testing.assert_allclose(loaded.positions[ids], locs.astype(np.float32))
+    shared = loaded.points_by_id[int(ids[15])]
+    assert sorted(f.id for f in shared.frames) == [frames[1].id, frames[2].id]
+
+    # the same map as with the submap paged back in
+    mapp.atlas.page_in(mapp, 0)
+    for f in mapp.frames:
+        g = loaded.frames_by_id[f.id]
+        np.testing.assert_array_equal(g.key_pts, f.key_pts)
+        np.testing.assert_array_equal(g.descriptors, f.descriptors)
+        np.testing.assert_allclose(g.pose, f.pose)
+    assert {a: dict(c) for a, c in loaded.covisibility.items() if c} == {
+        a: dict(c) for a, c in mapp.covisibility.items() if c
+    }
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from boxes.slam_toolbox import RansacBudget
+from boxes.slam_toolbox.match_frames import estimate_pose_USAC, ransac_iterations
+
+
+def test_adaptive_trials():
+    budget = RansacBudget(max_trials=300, min_trials=20)
+    assert budget.trials() == 300
+    budget.update(100, 90, 0.001)
+    assert budget.trials() == max(20, ransac_iterations(0.9 * 0.9, budget.confidence))
+    assert budget.needed == ransac_iterations(0.9, budget.confidence)
+    # a failure uses the full budget again
+    budget.update(100, 3, 0.001)
+    assert budget.trials() == 300 and budget.needed == 300
+
+
+def test_fixed_trials_keep_statistics():
+    budget = RansacBudget(max_trials=300, adaptive=False)
+    budget.update(100, 90, 0.001)
+    assert budget.trials() == 300
+    assert budget.needed == ransac_iterations(0.9, budget.confidence)
+
+
+def test_estimation_records_cap_and_time():
+    """Both the adaptive and the fixed budget report the cap and the time"""
+    rng = np.random.default_rng(0)
+    locs = rng.uniform((-2, -2, 4), (2, 2, 8), (100, 3))
+    kps1 = locs[:, :2] / locs[:, 2:]
+    moved = locs - (0.3, 0.0, 0.0)
+    kps2 = moved[:, :2] / moved[:, 2:]
+    f1, f2 = SimpleNamespace(kps=kps1), SimpleNamespace(kps=kps2)
+    idx = np.arange(len(locs))
+    for adaptive in (False, True):
+        budget = RansacBudget(max_trials=200, adaptive=adaptive)
+        budget.inlier_ratio = 0.95
+        cap = budget.trials()
+        idx1, _, Rt = estimate_pose_USAC(f1, f2, idx, idx, 0.001, 200, budget=budget)
+        assert Rt is not None and len(idx1) > 90
+        assert budget.last_cap == cap == (20 if adaptive else 200)
+        assert budget.time > 0.0
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from boxes.slam_toolbox import Frame, Map
+from boxes.slam_toolbox.match_frames import search_by_projection
+
+W, H = 640, 480
+K = np.array([[500.0, 0, W / 2], [0, 500.0, H / 2], [0, 0, 1]])
+
+
+def project(loc):
+    uv = K @ loc
+    return uv[:2] / uv[2]
+
+
+@pytest.mark.parametrize("orphan_first", [False, True])
+def test_point_without_observations(orphan_first):
+    """A point without observations is culled, first or last in the map"""
+    rng = np.random.default_rng(0)
+    image = np.empty((H, W, 3), np.uint8)
+    mapp = Map()
+    seen, orphan = np.array([0.5, 0.2, 5.0]), np.array([-0.5, -0.2, 5.0])
+    des = rng.integers(0, 256, (2, 32), dtype=np.uint8)
+
+    f2 = Frame(mapp, image, K, features=(project(seen)[None], des[:1]))
+    if orphan_first:
+        mapp.add_points([orphan], [(0, 0, 0)], [])
+    (point,) = mapp.add_points([seen], [(0, 0, 0)], [(f2, [0])])
+    if not orphan_first:
+        mapp.add_points([orphan], [(0, 0, 0)], [])
+
+    culled = mapp.cull_points()
+    assert culled.tolist() == [0 if orphan_first else 1]
+    assert mapp.alive_ids().tolist() == [point.id]
+
+    key_pts = np.array([project(orphan), project(seen)])
+    f1 = Frame(mapp, image, K, features=(key_pts, des[::-1]), keyframe=False)
+    idxs, points = search_by_projection(f1, mapp, K, W, H)
+    assert idxs.tolist() == [1]
+    assert [p.id for p in points] == [point.id]
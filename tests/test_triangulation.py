@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from boxes.slam_toolbox.match_frames import poseRt
+from boxes.slam_toolbox.triangulation import BACKENDS, triangulate
+
+
+def synthetic_views(n, noise, seed=0):
+    """Two cameras seeing n random points, noisy normalized image coordinates"""
+    rng = np.random.default_rng(seed)
+    pts = np.c_[rng.uniform(-5, 5, n), rng.uniform(-3, 3, n), rng.uniform(4, 30, n)]
+    yaw = 0.05
+    R = np.array(
+        [[np.cos(yaw), 0, np.sin(yaw)], [0, 1, 0], [-np.sin(yaw), 0, np.cos(yaw)]]
+    )
+    pose1, pose2 = poseRt(R, [-0.5, 0.0, 0.1]), np.eye(4)
+    homogeneous = np.c_[pts, np.ones(n)]
+    views = []
+    for pose in (pose1, pose2):
+        cam = (pose[:3] @ homogeneous.T).T
+        views.append(cam[:, 0:2] / cam[:, 2:] + rng.normal(0, noise, (n, 2)))
+    return pts, (pose1, pose2, views[0], views[1])
+
+
+def dehomogenize(pts4d):
+    return pts4d[:, 0:3] / pts4d[:, 3:]
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+@pytest.mark.parametrize("noise", [0.0, 1e-3])
+def test_backend_matches_loop(backend, noise):
+    _, views = synthetic_views(500, noise)
+    ref = dehomogenize(triangulate(*views, backend="Loop"))
+    pts = dehomogenize(triangulate(*views, backend=backend))
+    np.testing.assert_allclose(pts, ref, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_noiseless_points_recovered(backend):
+    pts, views = synthetic_views(200, 0.0, seed=1)
+    np.testing.assert_allclose(dehomogenize(triangulate(*views, backend=backend)), pts, atol=1e-6)
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_no_points(backend):
+    _, (pose1, pose2, pts1, pts2) = synthetic_views(3, 0.0)
+    assert triangulate(pose1, pose2, pts1[:0], pts2[:0], backend).shape == (0, 4)